@@ -0,0 +1,323 @@
+import asyncio
+from argparse import ArgumentParser
+from importlib import import_module
+from io import StringIO
+from json import dumps, loads
+from random import Random, randint
+from scenario import load_scenario
+from negotiator_framework import match_rng
+from tracing import TRACE_LEVELS, TRACE_SUMMARY, PrintTrace
+
+# An asyncio runtime for negotiators served as separate agents. An agent is a process serving one negotiator class
+# over localhost TCP or a Unix socket; every connection gets a fresh instance, so one agent plays any number of
+# matches at once. The protocol is one JSON object per line: after a greeting line naming the class, the framework
+# sends requests {"call": name, "args": [...]} and the agent answers each with {"result": value} or {"error": message}.
+# The calls are the BaseNegotiator methods the framework uses, plus "seed", which gives the negotiator a seeded rng.
+# negotiate_async() then plays a negotiation with every call awaited, so hundreds of matches interleave in one event
+# loop; LocalNegotiator puts an in-process negotiator behind the same interface.
+
+AGENT_CALLS = ("initialize", "make_offer", "utility", "receive_utility", "receive_results", "set_history_limits", "seed")
+
+# Longest protocol line, in bytes. asyncio's default of 64KiB is too short for offers of a few thousand items.
+LINE_LIMIT = 1 << 24
+
+# Raised when an agent reports an error, breaks the protocol or goes away
+class AgentError(Exception):
+    pass
+
+# What a match can fail with because of an agent (rather than a bug here): the agent's errors, and the connection's
+AGENT_FAILURES = (AgentError, OSError)
+
+# A negotiator served by an agent, reached through a connected stream pair
+class RemoteNegotiator:
+    def __init__(self, reader, writer, name):
+        self.reader = reader
+        self.writer = writer
+        # The negotiator class the agent serves, from its greeting
+        self.name = name
+        # Set once the connection has gone, so later calls fail straight away instead of writing into it
+        self.lost = False
+
+    # connect(address : String) --> RemoteNegotiator
+        # Connects to the agent at address, either "host:port" or "unix:path", and reads its greeting
+    @staticmethod
+    async def connect(address):
+        if address.startswith("unix:"):
+            (reader, writer) = await asyncio.open_unix_connection(address[len("unix:"):], limit=LINE_LIMIT)
+        else:
+            (host, port) = address.rsplit(":", 1)
+            (reader, writer) = await asyncio.open_connection(host, int(port), limit=LINE_LIMIT)
+        greeting = await reader.readline()
+        if not greeting:
+            raise AgentError("agent at {} closed the connection".format(address))
+        return RemoteNegotiator(reader, writer, loads(greeting)["agent"])
+
+    # call(self : RemoteNegotiator, name : String, args : tuple) --> value
+        # Makes one request and waits for its answer
+    async def call(self, name, *args):
+        if self.lost:
+            raise AgentError("{} closed the connection".format(self.name))
+        try:
+            self.writer.write((dumps({"call": name, "args": args}) + "\n").encode())
+            await self.writer.drain()
+            line = await self.reader.readline()
+            if not line:
+                self.lost = True
+                raise AgentError("{} closed the connection".format(self.name))
+            reply = loads(line)
+        except ValueError as error:
+            # An overlong line or one that isn't JSON
+            raise AgentError("{} broke the protocol: {}".format(self.name, error))
+        except OSError:
+            self.lost = True
+            raise
+        if "error" in reply:
+            raise AgentError("{}: {}".format(self.name, reply["error"]))
+        return reply["result"]
+
+    async def initialize(self, preferences, iter_limit):
+        await self.call("initialize", preferences, iter_limit)
+
+    async def make_offer(self, offer):
+        return await self.call("make_offer", offer)
+
+    async def utility(self):
+        return await self.call("utility")
+
+    async def receive_utility(self, utility):
+        await self.call("receive_utility", utility)
+
+    async def receive_results(self, results):
+        await self.call("receive_results", results)
+
+    async def seed(self, value):
+        await self.call("seed", value)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+# The in-process stand-in for an agent: the same awaitable interface, calling straight into a BaseNegotiator
+class LocalNegotiator:
+    def __init__(self, negotiator):
+        self.negotiator = negotiator
+        self.name = negotiator.__class__.__name__
+
+    async def initialize(self, preferences, iter_limit):
+        self.negotiator.initialize(preferences, iter_limit)
+
+    async def make_offer(self, offer):
+        return self.negotiator.make_offer(offer)
+
+    async def utility(self):
+        return self.negotiator.utility()
+
+    async def receive_utility(self, utility):
+        self.negotiator.receive_utility(utility)
+
+    async def receive_results(self, results):
+        self.negotiator.receive_results(results)
+
+    async def seed(self, value):
+        self.negotiator.rng = Random(value)
+
+    async def close(self):
+        pass
+
+# handle_request(negotiator : BaseNegotiator, request : dict) --> dict
+    # Carries out one protocol request on negotiator and returns the reply, reporting any exception as an error
+def handle_request(negotiator, request):
+    try:
+        if request["call"] not in AGENT_CALLS:
+            raise ValueError("unknown call {}".format(request["call"]))
+        if request["call"] == "seed":
+            negotiator.rng = Random(request["args"][0])
+            return {"result": None}
+        return {"result": getattr(negotiator, request["call"])(*request["args"])}
+    except Exception as error:
+        return {"error": "{}: {}".format(error.__class__.__name__, error)}
+
+# serve_connection(negotiator_class : type, reader : StreamReader, writer : StreamWriter)
+    # Serves one connection with a fresh instance of negotiator_class until the framework hangs up. The negotiator
+    # runs on the event loop, so a slow move holds up the agent's other connections; run one agent per core if that
+    # matters.
+async def serve_connection(negotiator_class, reader, writer):
+    negotiator = negotiator_class()
+    writer.write((dumps({"agent": negotiator_class.__name__}) + "\n").encode())
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            writer.write((dumps(handle_request(negotiator, loads(line))) + "\n").encode())
+            await writer.drain()
+    finally:
+        writer.close()
+
+# serve(negotiator_class : type, address : String)
+    # Runs an agent for negotiator_class at address ("host:port" or "unix:path") until cancelled
+async def serve(negotiator_class, address):
+    handler = lambda reader, writer: serve_connection(negotiator_class, reader, writer)
+    if address.startswith("unix:"):
+        server = await asyncio.start_unix_server(handler, address[len("unix:"):], limit=LINE_LIMIT)
+    else:
+        (host, port) = address.rsplit(":", 1)
+        server = await asyncio.start_server(handler, host, int(port), limit=LINE_LIMIT)
+    async with server:
+        await server.serve_forever()
+
+# seed_match_async(master_seed : Int, negotiator_a : RemoteNegotiator, negotiator_b : RemoteNegotiator, key : tuple) --> Random
+    # seed_match for agents: seeds both negotiators and returns the stream negotiate_async() should use. The draws
+    # are the same as seed_match's, so an in-process match plays exactly as it would under negotiate(); the global
+    # random module is left alone, since interleaved matches share it.
+async def seed_match_async(master_seed, negotiator_a, negotiator_b, *key):
+    if master_seed is None:
+        return None
+    rng = match_rng(master_seed, *key)
+    await negotiator_a.seed(rng.getrandbits(64))
+    await negotiator_b.seed(rng.getrandbits(64))
+    # seed_match's draw for the global random module
+    rng.getrandbits(64)
+    return rng
+
+# negotiate_async(num_iterations : Int, negotiator_a : RemoteNegotiator, negotiator_b : RemoteNegotiator, trace : Trace, rng : Random) --> (Boolean, list(String), Int)
+    # negotiate() with every call to the negotiators awaited, for agents or LocalNegotiators
+async def negotiate_async(num_iterations, negotiator_a, negotiator_b, trace=None, rng=None):
+    # Get the initial offer from negotiator a - we pass in None to signify that no previous opposing offers have been made
+    (offer_a, offer_b) = (await negotiator_a.make_offer(None), None)
+
+    # We scale the reported utility by a random factor
+    a_scale = rng.randint(1, 11) if rng is not None else randint(1, 11)
+    b_scale = rng.randint(1, 11) if rng is not None else randint(1, 11)
+    trace_turns = trace is not None and trace.wants_turns()
+
+    # Keep trading offers until we reach an agreement or the iteration limit, whichever comes first
+    for i in range(num_iterations):
+        if trace_turns:
+            trace.turn(i, offer_a, offer_b)
+
+        # Send b the utility a got from its latest offer, along with the offer, and allow it to rebut
+        await negotiator_b.receive_utility(a_scale * await negotiator_a.utility())
+        offer_b = await negotiator_b.make_offer(offer_a)
+
+        # We signify agreement by both offers being structurally equal
+        if offer_a == offer_b:
+            return (True, offer_a, i)
+
+        # If we didn't agree, let a respond to b's offer, sending it the utility b got from its offer first
+        await negotiator_a.receive_utility(b_scale * await negotiator_b.utility())
+        offer_a = await negotiator_a.make_offer(offer_b)
+
+        if offer_a == offer_b:
+            return (True, offer_a, i)
+
+    # If we failed overall, then there's no ordering to return
+    return (False, None, num_iterations)
+
+# play_match(scenario : Scenario, negotiator_a : RemoteNegotiator, negotiator_b : RemoteNegotiator, rounds : Int, master_seed : Int, trace : Trace) --> (Float, Float)
+    # Plays rounds negotiations on scenario the way the framework does, scoring and reporting each, and returns
+    # the total scores of A and B. A round in which an agent fails (see AGENT_FAILURES) fails with the usual penalty,
+    # the way a sandboxed negotiator's failure forfeits it in driver.py, and the match goes on.
+async def play_match(scenario, negotiator_a, negotiator_b, rounds=10, master_seed=None, trace=None):
+    trace = trace if trace is not None else PrintTrace(TRACE_SUMMARY)
+    trace.start_match("{} vs. {} on {}".format(negotiator_a.name, negotiator_b.name, scenario.name))
+    score_a = score_b = 0
+    try:
+        await negotiator_a.initialize(scenario.a_preferences(), scenario.iter_limit)
+        await negotiator_b.initialize(scenario.b_preferences(), scenario.iter_limit)
+    except AGENT_FAILURES as error:
+        trace.summary("Agent failure: {}".format(error))
+    for i in range(rounds):
+        try:
+            rng = await seed_match_async(master_seed, negotiator_a, negotiator_b, negotiator_a.name, negotiator_b.name, scenario.name, i)
+            (result, order, count) = await negotiate_async(scenario.iter_limit, negotiator_a, negotiator_b, trace, rng)
+            (points_a, points_b) = (await negotiator_a.utility(), await negotiator_b.utility()) if result else (-len(scenario), -len(scenario))
+        except AGENT_FAILURES as error:
+            trace.summary("Agent failure: {}".format(error))
+            (result, count) = (False, 0)
+            (points_a, points_b) = (-len(scenario), -len(scenario))
+        results = (result, points_a, points_b, count)
+        score_a += points_a
+        score_b += points_b
+        for negotiator in (negotiator_a, negotiator_b):
+            try:
+                await negotiator.receive_results(results)
+            except AGENT_FAILURES as error:
+                trace.summary("Agent failure: {}".format(error))
+        trace.summary("{} negotiation:\n\tNegotiator A: {}\n\tNegotiator B: {}".format("Successful" if result else "Failed", points_a, points_b))
+    return (score_a, score_b)
+
+# load_negotiator_class(spec : String) --> type
+    # The negotiator class named by spec, "module.Class" (e.g. testers.LinearNegotiator, or <your id>.Negotiator)
+def load_negotiator_class(spec):
+    (module, name) = spec.rsplit(".", 1)
+    return getattr(import_module(module), name)
+
+# open_negotiator(address : String) --> RemoteNegotiator
+    # Connects to the agent at address, or with "local:module.Class" creates an in-process negotiator
+async def open_negotiator(address):
+    if address.startswith("local:"):
+        return LocalNegotiator(load_negotiator_class(address[len("local:"):])())
+    return await RemoteNegotiator.connect(address)
+
+# close_quietly(negotiator : RemoteNegotiator)
+    # Closes negotiator's connection, which may already have been dropped
+async def close_quietly(negotiator):
+    try:
+        await negotiator.close()
+    except AGENT_FAILURES:
+        pass
+
+# play_all(address_a : String, address_b : String, scenarios : list(Scenario), rounds : Int, master_seed : Int, trace_level : Int, concurrency : Int) --> list((Float, Float, String))
+    # Plays one match per scenario between the negotiators at the two addresses, at most concurrency at a time, each
+    # over its own connections. Returns each match's scores and report, in the order of scenarios. A match whose
+    # agents can't be reached fails every round, so one bad connection costs only its own match.
+async def play_all(address_a, address_b, scenarios, rounds=10, master_seed=None, trace_level=TRACE_SUMMARY, concurrency=100):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def play(scenario):
+        async with slots:
+            output = StringIO()
+            trace = PrintTrace(trace_level, out=output)
+            negotiators = []
+            try:
+                for address in (address_a, address_b):
+                    negotiators.append(await open_negotiator(address))
+                (score_a, score_b) = await play_match(scenario, negotiators[0], negotiators[1], rounds, master_seed, trace)
+            except AGENT_FAILURES as error:
+                trace.summary("Match on {} failed: {}".format(scenario.name, error))
+                (score_a, score_b) = (-len(scenario) * rounds, -len(scenario) * rounds)
+            finally:
+                for negotiator in negotiators:
+                    await close_quietly(negotiator)
+            return (score_a, score_b, output.getvalue())
+
+    return await asyncio.gather(*(play(scenario) for scenario in scenarios))
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Serves negotiators as agents, or plays matches between agents")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="serve a negotiator class as an agent")
+    serve_parser.add_argument("negotiator", help="negotiator class as module.Class, e.g. testers.LinearNegotiator")
+    serve_parser.add_argument("address", help="host:port or unix:path to listen on")
+    play_parser = commands.add_parser("play", help="play a match on every scenario between two agents")
+    play_parser.add_argument("a", help="negotiator A: host:port or unix:path of an agent, or local:module.Class")
+    play_parser.add_argument("b", help="negotiator B, like a")
+    play_parser.add_argument("scenarios", nargs="+", help="scenario files, in csv format")
+    play_parser.add_argument("--rounds", type=int, default=10, help="negotiations per match")
+    play_parser.add_argument("--seed", type=int, help="master seed making the run reproducible")
+    play_parser.add_argument("--trace", choices=sorted(TRACE_LEVELS), default="summary", help="off: final results only, summary: also each round, turns: also every offer exchanged")
+    play_parser.add_argument("--concurrency", type=int, default=100, help="most matches played at once")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        asyncio.run(serve(load_negotiator_class(args.negotiator), args.address))
+    else:
+        scenarios = [load_scenario(scenario) for scenario in args.scenarios]
+        matches = asyncio.run(play_all(args.a, args.b, scenarios, args.rounds, args.seed, TRACE_LEVELS[args.trace], args.concurrency))
+        total_a = total_b = 0
+        for (score_a, score_b, output) in matches:
+            print(output, end="")
+            total_a += score_a
+            total_b += score_b
+        print("Final result:\n\tNegotiator A: {}\n\tNegotiator B: {}".format(total_a, total_b))
@@ -0,0 +1,182 @@
+from heapq import heappush, heappop
+from itertools import count
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Utility is a sum of per-(item, position) scores, so choosing an offer is a linear assignment problem:
+# assign every item (row of a score table) to one position (column) so the total score is as large as
+# possible. The helpers here solve that exactly, and enumerate solutions in descending order of score.
+
+# solve_assignment(score : list(list(Float)), forced : list((Int, Int)), forbidden : list((Int, Int))) --> (Float, list(Int))
+    # Finds the maximum-score assignment for a square score table with the Hungarian algorithm, in
+    # O(n^3). forced lists (row, column) pairs that must be used and forbidden lists pairs that must not.
+    # Returns (total score, cols) where cols[row] is the column assigned to row, or None if the
+    # constraints leave no valid assignment.
+def solve_assignment(score, forced=(), forbidden=()):
+    n = len(score)
+    cols = [-1] * n
+    used_cols = set()
+    for row, col in forced:
+        cols[row] = col
+        used_cols.add(col)
+    free_rows = [row for row in range(n) if cols[row] == -1]
+    free_cols = [col for col in range(n) if col not in used_cols]
+    if free_rows:
+        col_index = {col: j for j, col in enumerate(free_cols)}
+        # Forbidden cells get a cost so high that using one can never beat any valid assignment: even with every other
+        # row at the lowest cost, it still costs more than every row at the highest
+        (low, high) = (min(min(row) for row in score), max(max(row) for row in score))
+        blocked = -low + n * (high - low) + 1
+        cost = [[-score[row][col] for col in free_cols] for row in free_rows]
+        row_index = {row: i for i, row in enumerate(free_rows)}
+        blocked_cells = set()
+        for row, col in forbidden:
+            if row in row_index and col in col_index:
+                cost[row_index[row]][col_index[col]] = blocked
+                blocked_cells.add((row, col))
+        for i, j in enumerate(hungarian(cost)):
+            if (free_rows[i], free_cols[j]) in blocked_cells:
+                return None
+            cols[free_rows[i]] = free_cols[j]
+    return (assignment_total(score, cols), cols)
+
+# assignment_total(score : list(list(Float)), cols : list(Int)) --> Float
+    # Total score of an assignment. Sums in column (offer position) order, so the total matches
+    # BaseNegotiator.utility() to the last bit.
+def assignment_total(score, cols):
+    rows = [0] * len(cols)
+    for row, col in enumerate(cols):
+        rows[col] = row
+    return sum(score[row][col] for col, row in enumerate(rows))
+
+# hungarian(cost : list(list(Float))) --> list(Int)
+    # Minimum-cost assignment for a square cost table, using the shortest augmenting path formulation
+    # of the Hungarian algorithm with row and column potentials. Returns the column chosen for each row.
+def hungarian(cost):
+    n = len(cost)
+    if np is not None and n > 16:
+        return hungarian_vectorized(cost)
+    inf = float('inf')
+    # Potentials for rows (u) and columns (v), the row matched to each column (p, 1-based with 0 as the
+    # virtual start column) and the previous column on the augmenting path (way)
+    u = [0] * (n + 1)
+    v = [0] * (n + 1)
+    p = [0] * (n + 1)
+    way = [0] * (n + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (n + 1)
+        used = [False] * (n + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = cost[i0 - 1]
+            delta = inf
+            j1 = 0
+            for j in range(1, n + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(n + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # Flip the matching along the augmenting path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    cols = [0] * n
+    for j in range(1, n + 1):
+        cols[p[j] - 1] = j - 1
+    return cols
+
+# tradeoff_assignment(mine : list(list(Float)), theirs : list(list(Float)), weight : Float) --> (Float, Float, list(Int))
+    # Solves for the assignment maximizing mine + weight * theirs - a weight of 1 gives the maximum joint
+    # score, and 0 ignores theirs entirely. As the weight grows, my total can only fall and theirs can
+    # only rise. Returns (my total, their total, cols).
+def tradeoff_assignment(mine, theirs, weight):
+    combined = [[m + weight * t for m, t in zip(my_row, their_row)] for my_row, their_row in zip(mine, theirs)]
+    (value, cols) = solve_assignment(combined)
+    return (assignment_total(mine, cols), assignment_total(theirs, cols), cols)
+
+# hungarian_vectorized(cost : list(list(Float))) --> list(Int)
+    # The same algorithm as hungarian(), step for step, with each scan over the columns done as one NumPy operation.
+    # Used for larger tables when NumPy is installed.
+def hungarian_vectorized(cost):
+    cost = np.asarray(cost, dtype=float)
+    n = len(cost)
+    u = np.zeros(n + 1)
+    v = np.zeros(n + 1)
+    p = np.zeros(n + 1, dtype=np.intp)
+    way = np.zeros(n + 1, dtype=np.intp)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(n + 1, np.inf)
+        used = np.zeros(n + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            improved = free & (cur < minv[1:])
+            minv[1:][improved] = cur[improved]
+            way[1:][improved] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # Flip the matching along the augmenting path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    cols = [0] * n
+    for j in range(1, n + 1):
+        cols[p[j] - 1] = j - 1
+    return cols
+
+# ranked_assignments(score : list(list(Float)), floor : Float) --> generator((Float, list(Int)))
+    # Yields every assignment of the score table in descending order of total score, as
+    # (total score, cols) pairs, using Murty's k-best partitioning. Each assignment after the first costs
+    # at most n assignment solves. If floor is given, stops once the remaining assignments all score below it.
+def ranked_assignments(score, floor=None):
+    tiebreak = count()
+    heap = []
+
+    def push(forced, forbidden):
+        solution = solve_assignment(score, forced, forbidden)
+        if solution is not None and (floor is None or solution[0] >= floor):
+            heappush(heap, (-solution[0], next(tiebreak), solution[1], forced, forbidden))
+
+    push((), ())
+    while heap:
+        (neg_value, _, cols, forced, forbidden) = heappop(heap)
+        yield (-neg_value, cols)
+        # Split the remaining solutions of this subproblem into disjoint subproblems: the i-th keeps the
+        # first i free rows of this solution and forbids its choice for the next one
+        forced_rows = {row for row, col in forced}
+        free_rows = [row for row in range(len(cols)) if row not in forced_rows]
+        child_forced = forced
+        for row in free_rows[:-1]:
+            push(child_forced, forbidden + ((row, cols[row]),))
+            child_forced = child_forced + ((row, cols[row]),)
@@ -0,0 +1,287 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from argparse import ArgumentParser
+from scenario import ItemTable, Scenario
+from scenario_generator import CORRELATIONS
+from testers import LinearNegotiator, MeanNegotiator, PseudoRandomNegotiator
+from negotiator_framework import negotiate, seed_match
+
+# Lock-step batch simulation of the simple strategies, for parameter studies that need far more negotiations than
+# negotiate() can run one Python object at a time. A batch is N independent negotiations between fresh negotiators,
+# each on its own scenario. Every side's state (offers, thresholds, the utilities it has been told) is a NumPy array
+# with one row per negotiation, and each turn of negotiate() is a handful of vectorized operations over the rows still
+# negotiating. The rules - including the scaled utilities each side is told, and which offer each side's points come
+# from - follow negotiate() and the negotiator classes exactly; only the random draws differ, so results agree with
+# negotiate() statistically rather than run for run.
+
+# gather(table : 2-D array, rows : array(Int), columns : 2-D array(Int)) --> 2-D array
+    # table[rows[k]][columns[k][j]] for every k and j, as one flat take - much cheaper than take_along_axis on
+    # table[rows], which copies the rows and broadcasts the indices first
+def gather(table, rows, columns):
+    return np.take(table.ravel(), columns + (rows * table.shape[1])[:, None])
+
+# One side of a batch of negotiations, all playing the same strategy. Offers are rows of item ids; prefs[k] is this
+# side's preference order in negotiation k and ranks[k][item] the item's rank in it. rows always lists the
+# negotiations (row numbers) a call applies to, and the offers passed in or returned line up with it.
+class BatchStrategy:
+    def __init__(self, prefs, iter_limit, rng):
+        (count, num_items) = prefs.shape
+        self.prefs = prefs
+        self.ranks = np.empty_like(prefs)
+        np.put_along_axis(self.ranks, prefs, np.arange(num_items), axis=1)
+        self.iter_limit = iter_limit
+        self.rng = rng
+        self.positions = np.arange(num_items)
+        self.weights = num_items / (self.positions + 1)
+        self.max_utility = self.weights.sum()
+        self.relax_factor = num_items / iter_limit
+        # Our current offer (self.offer), our utility for it, and whether we have made one yet
+        self.offer = prefs.copy()
+        self.offer_utility = np.zeros(count)
+        self.has_offer = np.zeros(count, dtype=bool)
+        self.past_iters = np.zeros(count, dtype=np.int64)
+        self.max_threshold = np.zeros(count)
+        self.min_threshold = np.zeros(count)
+        self.threshold_step = np.zeros(count)
+        # The last two utilities they reported, and how many they have reported
+        self.reported = np.zeros(count)
+        self.previous_reported = np.zeros(count)
+        self.reported_count = np.zeros(count, dtype=np.int64)
+
+    # utilities(self : BatchStrategy, offers : 2-D array(Int), rows : array(Int)) --> array(Float)
+        # Our utility for each offer, as BaseNegotiator.utility computes it. The position weights add up to
+        # max_utility in every offer, so only the displacements need summing per offer.
+    def utilities(self, offers, rows):
+        ranks = gather(self.ranks, rows, offers)
+        return self.max_utility - np.abs(self.positions - ranks).sum(axis=1)
+
+    # utility(self : BatchStrategy, rows : array(Int)) --> array(Float)
+        # Our utility for our own current offer; 0 before we have made one, like an empty self.offer
+    def utility(self, rows):
+        return np.where(self.has_offer[rows], self.offer_utility[rows], 0)
+
+    # open(self : BatchStrategy) --> 2-D array(Int)
+        # make_offer(None) in every negotiation: all the strategies open with their preferences
+    def open(self):
+        self.offer[:] = self.prefs
+        self.offer_utility[:] = self.max_utility
+        self.has_offer[:] = True
+        return self.offer.copy()
+
+    def receive_utility(self, utilities, rows):
+        self.previous_reported[rows] = self.reported[rows]
+        self.reported[rows] = utilities
+        self.reported_count[rows] += 1
+
+    # respond(self : BatchStrategy, offers : 2-D array(Int), rows : array(Int)) --> 2-D array(Int)
+        # make_offer(offer) in each of the rows: returns the offer itself to accept it, or a counteroffer
+    def respond(self, offers, rows):
+        pass
+
+    # start_thresholds(self : BatchStrategy, rows : array(Int))
+        # Sets up the acceptance thresholds in the rows where we are making our first response
+    def start_thresholds(self, rows):
+        first = rows[self.past_iters[rows] == 0]
+        self.max_threshold[first] = 0.9 * self.max_utility
+        self.min_threshold[first] = 0.1 * self.max_utility
+        self.threshold_step[first] = (self.max_threshold[first] - self.min_threshold[first]) / self.iter_limit
+
+    # counter(self : BatchStrategy, offers : 2-D array(Int), accept : array(Boolean), counteroffers : 2-D array(Int), rows : array(Int)) --> 2-D array(Int)
+        # Responds with the offer where accept is set, and with the counteroffer (which becomes our offer) elsewhere
+    def counter(self, offers, accept, counteroffers, rows):
+        rejected = rows[~accept]
+        self.offer[rejected] = counteroffers
+        self.offer_utility[rejected] = self.utilities(counteroffers, rejected)
+        self.has_offer[rejected] = True
+        responses = offers.copy()
+        responses[~accept] = counteroffers
+        return responses
+
+# MeanNegotiator: always insists on its preferences
+class BatchMean(BatchStrategy):
+    def respond(self, offers, rows):
+        self.offer[rows] = self.prefs[rows]
+        self.offer_utility[rows] = self.max_utility
+        self.has_offer[rows] = True
+        return self.prefs[rows]
+
+# LinearNegotiator: accepts offers above a threshold that falls linearly from 90% to 10% of its best utility, and
+# otherwise counters with its preferences, shuffling a tail that grows every turn
+class BatchLinear(BatchStrategy):
+    def respond(self, offers, rows):
+        self.start_thresholds(rows)
+        utilities = self.utilities(offers, rows)
+        accept = (self.past_iters[rows] == self.iter_limit) & (utilities > self.min_threshold[rows])
+        self.past_iters[rows] += 1
+        accept |= utilities > self.max_threshold[rows]
+        rejected = rows[~accept]
+        self.max_threshold[rejected] -= self.threshold_step[rejected]
+        return self.counter(offers, accept, self.relaxed_offers(rejected), rows)
+
+    # relaxed_offers(self : BatchLinear, rows : array(Int)) --> 2-D array(Int)
+        # calc_new_offer: our preferences with the last int(relax_factor * past_iters) + 1 items shuffled
+    def relaxed_offers(self, rows):
+        num_items = len(self.positions)
+        relax = np.minimum((self.relax_factor * self.past_iters[rows]).astype(np.int64) + 1, num_items)
+        # Sorting on these keys keeps the head in place and puts the tail in uniformly random order
+        keys = self.rng.random((len(rows), num_items))
+        keys = np.where(self.positions < (num_items - relax)[:, None], self.positions - num_items, keys)
+        return gather(self.prefs, rows, np.argsort(keys, axis=1))
+
+# PseudoRandomNegotiator: moves its threshold against the trend in the utilities they report, and otherwise counters
+# by swapping two random items of its last offer
+class BatchSwap(BatchStrategy):
+    def respond(self, offers, rows):
+        self.start_thresholds(rows)
+        utilities = self.utilities(offers, rows)
+        accept = (self.past_iters[rows] == self.iter_limit) & (utilities > self.min_threshold[rows])
+        self.past_iters[rows] += 1
+        trending = self.reported_count[rows] > 1
+        # A zero previous utility makes the trend inf or nan, which (unlike ZeroDivisionError in the class) just
+        # leaves the threshold alone
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trend = (self.reported[rows] - self.previous_reported[rows]) / self.previous_reported[rows]
+            adjust = trending & (np.abs(trend) < 0.99)
+        adjusted = rows[adjust]
+        self.max_threshold[adjusted] -= self.max_threshold[adjusted] * trend[adjust]
+        accept |= trending & (utilities >= self.max_threshold[rows])
+        return self.counter(offers, accept, self.swapped_offers(rows[~accept]), rows)
+
+    # swapped_offers(self : BatchSwap, rows : array(Int)) --> 2-D array(Int)
+        # calc_new_offer: our last offer with two random positions swapped, or our preferences if we have none
+    def swapped_offers(self, rows):
+        has_offer = self.has_offer[rows]
+        offers = np.where(has_offer[:, None], self.offer[rows], self.prefs[rows])
+        count = len(rows)
+        first = self.rng.integers(0, len(self.positions), count)
+        second = self.rng.integers(0, len(self.positions), count)
+        swapped = np.flatnonzero(has_offer)
+        first_items = offers[swapped, first[swapped]]
+        offers[swapped, first[swapped]] = offers[swapped, second[swapped]]
+        offers[swapped, second[swapped]] = first_items
+        return offers
+
+# The negotiator classes the batch simulator can play, and their batch implementations
+BATCH_STRATEGIES = {MeanNegotiator: BatchMean, LinearNegotiator: BatchLinear, PseudoRandomNegotiator: BatchSwap}
+
+# simulate_batch(negotiator_a : type, negotiator_b : type, a_prefs : 2-D array(Int), b_prefs : 2-D array(Int), iter_limit : Int, seed : Int) --> dict
+    # Runs one negotiation per row of a_prefs and b_prefs (each row a preference order over the item ids 0..n-1)
+    # between fresh instances of the two classes, which must be in BATCH_STRATEGIES. Returns arrays with an entry per
+    # negotiation: 'agreed', 'iterations' (as negotiate() counts them), 'offers' (the agreed offer, where there is one)
+    # and 'points_a' and 'points_b', scored as driver.py scores a round.
+def simulate_batch(negotiator_a, negotiator_b, a_prefs, b_prefs, iter_limit, seed=None):
+    if np is None:
+        raise ImportError("the batch simulator needs NumPy")
+    for negotiator in (negotiator_a, negotiator_b):
+        if negotiator not in BATCH_STRATEGIES:
+            raise ValueError("{} can't be batch simulated; supported are {}".format(negotiator.__name__, ", ".join(supported.__name__ for supported in BATCH_STRATEGIES)))
+    rng = np.random.default_rng(seed)
+    # Item ids fit comfortably in 32 bits, and the narrower rows halve the memory every turn has to stream through
+    a_prefs = np.asarray(a_prefs, dtype=np.int32)
+    b_prefs = np.asarray(b_prefs, dtype=np.int32)
+    (count, num_items) = a_prefs.shape
+    side_a = BATCH_STRATEGIES[negotiator_a](a_prefs, iter_limit, rng)
+    side_b = BATCH_STRATEGIES[negotiator_b](b_prefs, iter_limit, rng)
+    offer_a = side_a.open()
+    offer_b = np.full_like(offer_a, -1)
+    a_scale = rng.integers(1, 12, count)
+    b_scale = rng.integers(1, 12, count)
+    agreed = np.zeros(count, dtype=bool)
+    iterations = np.full(count, iter_limit)
+    offers = np.full_like(offer_a, -1)
+
+    # settle(rows : array(Int), i : Int) --> array(Int)
+        # Records the negotiations in rows whose offers now match, returning the rows still negotiating
+    def settle(rows, i):
+        done = (offer_a[rows] == offer_b[rows]).all(axis=1)
+        finished = rows[done]
+        agreed[finished] = True
+        iterations[finished] = i
+        offers[finished] = offer_a[finished]
+        return rows[~done]
+
+    rows = np.arange(count)
+    for i in range(iter_limit):
+        if len(rows) == 0:
+            break
+        side_b.receive_utility(a_scale[rows] * side_a.utility(rows), rows)
+        offer_b[rows] = side_b.respond(offer_a[rows], rows)
+        rows = settle(rows, i)
+        side_a.receive_utility(b_scale[rows] * side_b.utility(rows), rows)
+        offer_a[rows] = side_a.respond(offer_b[rows], rows)
+        rows = settle(rows, i)
+
+    every_row = np.arange(count)
+    return {
+            "agreed": agreed,
+            "iterations": iterations,
+            "offers": offers,
+            "points_a": np.where(agreed, side_a.utility(every_row), -num_items),
+            "points_b": np.where(agreed, side_b.utility(every_row), -num_items)
+            }
+
+# generate_orders(count : Int, num_items : Int, correlation : String, noise : Float, seed : Int) --> (2-D array(Int), 2-D array(Int))
+    # Preference orders for count scenarios at once, related the same way generate_scenario relates them (see
+    # scenario_generator.py), as the a_prefs and b_prefs of simulate_batch
+def generate_orders(count, num_items, correlation="random", noise=0.25, seed=None):
+    if correlation not in CORRELATIONS:
+        raise ValueError("correlation must be one of {}".format(", ".join(CORRELATIONS)))
+    rng = np.random.default_rng(seed)
+    a_prefs = np.argsort(rng.random((count, num_items)), axis=1)
+    if correlation == "identical":
+        b_prefs = a_prefs.copy()
+    elif correlation == "random":
+        b_prefs = np.take_along_axis(a_prefs, np.argsort(rng.random((count, num_items)), axis=1), axis=1)
+    elif correlation == "opposite":
+        b_prefs = a_prefs[:, ::-1].copy()
+    else:
+        keys = np.arange(num_items) + rng.normal(0, noise * num_items, (count, num_items))
+        b_prefs = np.take_along_axis(a_prefs, np.argsort(keys, axis=1, kind='stable'), axis=1)
+    return (a_prefs, b_prefs)
+
+# simulate_each(negotiator_a : type, negotiator_b : type, a_prefs : 2-D array(Int), b_prefs : 2-D array(Int), iter_limit : Int, seed : Int) --> dict
+    # The same as simulate_batch, but running every negotiation through negotiate() with real negotiators. Slow;
+    # it is here to check the batch simulator against.
+def simulate_each(negotiator_a, negotiator_b, a_prefs, b_prefs, iter_limit, seed=None):
+    (count, num_items) = np.shape(a_prefs)
+    items = ItemTable("item{}".format(i) for i in range(num_items))
+    results = {"agreed": [], "iterations": [], "points_a": [], "points_b": []}
+    for k in range(count):
+        scenario = Scenario(iter_limit, items, tuple(int(item) for item in a_prefs[k]), tuple(int(item) for item in b_prefs[k]))
+        a = negotiator_a()
+        b = negotiator_b()
+        a.initialize(scenario.a_preferences(), iter_limit)
+        b.initialize(scenario.b_preferences(), iter_limit)
+        rng = seed_match(seed, a, b, negotiator_a.__name__, negotiator_b.__name__, k)
+        (result, order, iterations) = negotiate(iter_limit, a, b, rng=rng)
+        results["agreed"].append(result)
+        results["iterations"].append(iterations)
+        results["points_a"].append(a.utility() if result else -num_items)
+        results["points_b"].append(b.utility() if result else -num_items)
+    return {key: np.asarray(values) for (key, values) in results.items()}
+
+# summarize(results : dict) --> String
+    # One line of statistics over the results of simulate_batch or simulate_each
+def summarize(results):
+    return "agreed {:6.1%}   iterations {:8.2f}   points A {:9.2f} (sd {:7.2f})   points B {:9.2f} (sd {:7.2f})".format(results["agreed"].mean(), results["iterations"].mean(), results["points_a"].mean(), results["points_a"].std(), results["points_b"].mean(), results["points_b"].std())
+
+if __name__ == "__main__":
+    names = {negotiator.__name__: negotiator for negotiator in BATCH_STRATEGIES}
+    parser = ArgumentParser(description="Simulates a batch of negotiations between two of the simple strategies in lock step")
+    parser.add_argument("negotiator_a", choices=names, help="class playing A")
+    parser.add_argument("negotiator_b", choices=names, help="class playing B")
+    parser.add_argument("--count", type=int, default=100000, help="number of negotiations")
+    parser.add_argument("--items", type=int, default=20, help="items per scenario")
+    parser.add_argument("--iterations", type=int, default=50, help="iteration limit")
+    parser.add_argument("--correlation", choices=CORRELATIONS, default="random", help="how B's preferences relate to A's")
+    parser.add_argument("--noise", type=float, default=0.25, help="preference noise for --correlation partial")
+    parser.add_argument("--seed", type=int, help="seed making the run reproducible")
+    parser.add_argument("--check", type=int, default=0, help="also run this many of the negotiations through negotiate(), for comparison")
+    args = parser.parse_args()
+
+    (a_prefs, b_prefs) = generate_orders(args.count, args.items, args.correlation, args.noise, args.seed)
+    print("batch      {}".format(summarize(simulate_batch(names[args.negotiator_a], names[args.negotiator_b], a_prefs, b_prefs, args.iterations, args.seed))))
+    if args.check > 0:
+        print("negotiate  {}".format(summarize(simulate_each(names[args.negotiator_a], names[args.negotiator_b], a_prefs[:args.check], b_prefs[:args.check], args.iterations, args.seed))))
@@ -0,0 +1,104 @@
+from argparse import ArgumentParser
+from json import dump, load
+from random import Random
+from sys import exit
+from time import perf_counter
+from negotiator import Negotiator, BANegotiator
+from testers import LinearNegotiator, AsymptoticNegotiator, LinearThenAsymptoticNegotiator, FlexibleNegotiator, MeanNegotiator, PseudoRandomNegotiator
+from negotiator_framework import negotiate, seed_match
+from scenario_generator import generate_scenario
+
+# Micro-benchmarks for make_offer. Every negotiator class is played as B against the random Negotiator on generated
+# scenarios, over a grid of item counts and iteration limits, and each of its make_offer calls is timed. Results are
+# reported as latency percentiles and throughput, and can be saved as a baseline and compared against on later runs.
+
+negotiators = [LinearNegotiator, AsymptoticNegotiator, LinearThenAsymptoticNegotiator, FlexibleNegotiator, MeanNegotiator, PseudoRandomNegotiator, BANegotiator, Negotiator]
+
+# percentile(samples : list(Float), fraction : Float) --> Float
+    # Nearest-rank percentile of a sorted list of samples
+def percentile(samples, fraction):
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))]
+
+# benchmark_make_offer(negotiator_class : type, num_items : Int, iter_limit : Int, min_samples : Int, seed : Int) --> dict
+    # Times make_offer for negotiator_class on one point of the grid. Negotiations are repeated on fresh scenarios
+    # until at least min_samples calls have been timed. Returns p50 and p99 latency in seconds, throughput in calls
+    # per second and the number of samples.
+def benchmark_make_offer(negotiator_class, num_items, iter_limit, min_samples=200, seed=0):
+    samples = []
+    rng = Random(seed)
+    rounds = 0
+    while len(samples) < min_samples:
+        scenario = generate_scenario(num_items, iter_limit, "random", rng=rng)
+        negotiator_a = Negotiator()
+        negotiator_b = negotiator_class()
+        negotiator_a.initialize(scenario.a_preferences(), iter_limit)
+        negotiator_b.initialize(scenario.b_preferences(), iter_limit)
+        make_offer = negotiator_b.make_offer
+
+        def timed_make_offer(offer):
+            start = perf_counter()
+            response = make_offer(offer)
+            samples.append(perf_counter() - start)
+            return response
+
+        negotiator_b.make_offer = timed_make_offer
+        match_rng = seed_match(seed, negotiator_a, negotiator_b, negotiator_class.__name__, num_items, iter_limit, rounds)
+        negotiate(iter_limit, negotiator_a, negotiator_b, rng=match_rng)
+        rounds += 1
+    total = sum(samples)
+    samples.sort()
+    return {
+            "p50": percentile(samples, .5),
+            "p99": percentile(samples, .99),
+            "throughput": len(samples) / total if total > 0 else 0,
+            "samples": len(samples)
+            }
+
+# benchmark_key(negotiator_class : type, num_items : Int, iter_limit : Int) --> String
+    # Name of a grid point in saved baselines
+def benchmark_key(negotiator_class, num_items, iter_limit):
+    return "{}/{}/{}".format(negotiator_class.__name__, num_items, iter_limit)
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measures make_offer latency for every negotiator class")
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 50, 200], help="item counts to benchmark")
+    parser.add_argument("--iterations", type=int, nargs="+", default=[10, 50], help="iteration limits to benchmark")
+    parser.add_argument("--classes", nargs="+", help="only benchmark these negotiator classes")
+    parser.add_argument("--samples", type=int, default=200, help="minimum make_offer calls timed per grid point")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated scenarios and the negotiators")
+    parser.add_argument("--baseline", help="compare against results previously saved with --save")
+    parser.add_argument("--threshold", type=float, default=1.25, help="flag a regression when p50 or p99 exceeds the baseline by this factor")
+    parser.add_argument("--save", help="save the results to this file, for use as a later --baseline")
+    args = parser.parse_args()
+
+    classes = [negotiator for negotiator in negotiators if args.classes is None or negotiator.__name__ in args.classes]
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = load(baseline_file)
+    results = {}
+    regressions = 0
+    print("{:<32} {:>6} {:>6} {:>8} {:>12} {:>12} {:>12}  {}".format("negotiator", "items", "iters", "samples", "p50 (us)", "p99 (us)", "calls/s", "vs. baseline"))
+    for negotiator in classes:
+        for num_items in args.items:
+            for iter_limit in args.iterations:
+                key = benchmark_key(negotiator, num_items, iter_limit)
+                result = benchmark_make_offer(negotiator, num_items, iter_limit, args.samples, args.seed)
+                results[key] = result
+                comparison = ""
+                if key in baseline:
+                    ratio_p50 = result["p50"] / baseline[key]["p50"] if baseline[key]["p50"] > 0 else 1
+                    ratio_p99 = result["p99"] / baseline[key]["p99"] if baseline[key]["p99"] > 0 else 1
+                    comparison = "p50 x{:.2f}, p99 x{:.2f}".format(ratio_p50, ratio_p99)
+                    if ratio_p50 > args.threshold or ratio_p99 > args.threshold:
+                        comparison += "  REGRESSION"
+                        regressions += 1
+                print("{:<32} {:>6} {:>6} {:>8} {:>12.1f} {:>12.1f} {:>12.0f}  {}".format(negotiator.__name__, num_items, iter_limit, result["samples"], result["p50"] * 1e6, result["p99"] * 1e6, result["throughput"], comparison))
+    if args.save is not None:
+        with open(args.save, 'w') as save_file:
+            dump(results, save_file, indent=2, sort_keys=True)
+    if regressions:
+        print("{} regression(s) against {}".format(regressions, args.baseline))
+        exit(1)
@@ -0,0 +1,133 @@
+import signal
+from threading import current_thread, main_thread
+from time import perf_counter
+
+# Time budgets for negotiate(). Each negotiator may spend at most per_move seconds on a single make_offer, and at
+# most per_match seconds over all of its moves in one negotiation. Where SIGALRM is available (Unix, main thread) a
+# move that runs over is interrupted, and since its state can't be trusted after that the negotiator is reset (see
+# BaseNegotiator.reset); elsewhere the budget is checked once the move returns. Either way the overrun is recorded
+# and the move is replaced according to policy: "repeat" re-sends the negotiator's previous offer (or forfeits if it
+# has none yet), "forfeit" ends the negotiation without agreement.
+
+OVERRUN_POLICIES = ("repeat", "forfeit")
+
+# SIGALRM and interval timers only exist on Unix
+ALARMS = hasattr(signal, "SIGALRM")
+
+# Raised inside a move when its time is up
+class MoveTimeout(Exception):
+    pass
+
+# Raised out of a move to end the negotiation without agreement
+class MoveForfeited(Exception):
+    pass
+
+class TimeBudget:
+    def __init__(self, per_move=None, per_match=None, policy="repeat"):
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError("policy must be one of {}".format(", ".join(OVERRUN_POLICIES)))
+        self.per_move = per_move
+        self.per_match = per_match
+        self.policy = policy
+        # One dict per overrun: match, side, negotiator, move number, seconds spent and what was done about it. A
+        # negotiator that raised an error is recorded here too, with the error in place of the seconds.
+        self.overruns = []
+        # Move counts etc. of each side's current negotiation, by side
+        self.states = {}
+        # Label of the match the next negotiations belong to
+        self.match = None
+
+    # start_match(self : TimeBudget, match : String)
+        # Labels the overruns recorded from now on
+    def start_match(self, match):
+        self.match = match
+
+    # bind(self : TimeBudget, side : String, negotiator : BaseNegotiator) --> function
+        # Returns a replacement for negotiator.make_offer that enforces the budget for one negotiation. side ('a' or
+        # 'b') is only used for reporting.
+    def bind(self, side, negotiator):
+        state = {'spent': 0, 'moves': 0, 'last_offer': None}
+        self.states[side] = state
+
+        def make_offer(offer):
+            limit = self.per_move
+            if self.per_match is not None:
+                remaining = max(0, self.per_match - state['spent'])
+                limit = remaining if limit is None else min(limit, remaining)
+            state['moves'] += 1
+            if limit is not None and limit <= 0:
+                # No time left at all, so the move isn't started
+                return self.overrun(side, negotiator, state, 0)
+            start = perf_counter()
+            try:
+                response = run_with_timeout(negotiator.make_offer, offer, limit)
+            except MoveTimeout:
+                elapsed = perf_counter() - start
+                state['spent'] += elapsed
+                # Cut short part way, so the negotiator starts over from a clean state before the policy applies
+                negotiator.reset()
+                return self.overrun(side, negotiator, state, elapsed, "interrupted, ")
+            elapsed = perf_counter() - start
+            state['spent'] += elapsed
+            if limit is not None and elapsed > limit:
+                return self.overrun(side, negotiator, state, elapsed)
+            state['last_offer'] = response
+            return response
+
+        return make_offer
+
+    def overrun(self, side, negotiator, state, elapsed, prefix=""):
+        repeat = self.policy == "repeat" and state['last_offer'] is not None
+        self.record(side, negotiator, state, elapsed, prefix + ("repeated last offer" if repeat else "forfeited"))
+        if not repeat:
+            raise MoveForfeited()
+        # Keep the negotiator's own idea of its offer in line with what it is taken to have said
+        negotiator.offer = state['last_offer'][:]
+        return state['last_offer'][:]
+
+    # failed(self : TimeBudget, side : String, negotiator : BaseNegotiator, error : Exception)
+        # Records that negotiator raised error during its current negotiation, and was made to forfeit it
+    def failed(self, side, negotiator, error):
+        state = self.states.get(side, {'moves': 0})
+        self.record(side, negotiator, state, None, "forfeited", "{}: {}".format(error.__class__.__name__, error))
+
+    def record(self, side, negotiator, state, elapsed, action, error=None):
+        self.overruns.append({
+                'match': self.match,
+                'side': side,
+                'negotiator': negotiator.__class__.__name__,
+                'move': state['moves'],
+                'seconds': elapsed,
+                'error': error,
+                'action': action
+                })
+
+    # report(self : TimeBudget) --> String
+    def report(self):
+        return "\n".join(describe(overrun) for overrun in self.overruns)
+
+def describe(overrun):
+    if overrun['error'] is not None:
+        return "Failure in {}: {} ({}) raised {} on move {}, {}".format(overrun['match'], overrun['negotiator'], overrun['side'].upper(), overrun['error'], overrun['move'], overrun['action'])
+    return "Overrun in {}: {} ({}) took {:.3f}s on move {}, {}".format(overrun['match'], overrun['negotiator'], overrun['side'].upper(), overrun['seconds'], overrun['move'], overrun['action'])
+
+def raise_timeout(signum, frame):
+    raise MoveTimeout()
+
+# run_with_timeout(function : function, argument, seconds : Float) --> result of function(argument)
+    # Calls function(argument), interrupting it with MoveTimeout after seconds if SIGALRM can be used here. With
+    # seconds of None (no limit) or 0 (no time left) it is called normally, or not at all.
+def run_with_timeout(function, argument, seconds):
+    if seconds is None:
+        return function(argument)
+    if seconds <= 0:
+        raise MoveTimeout()
+    if not ALARMS or current_thread() is not main_thread():
+        return function(argument)
+    previous = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        return function(argument)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
@@ -1,122 +1,200 @@
 
-from csv import DictReader
-from sys import argv, exit
+from sys import exit
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
 from itertools import islice
 from negotiator import Negotiator, BANegotiator
 from testers import LinearNegotiator, AsymptoticNegotiator, LinearThenAsymptoticNegotiator, FlexibleNegotiator, MeanNegotiator, PseudoRandomNegotiator
-from random import seed, randint
+from random import seed
+from scenario import load_scenario
+from negotiator_framework import negotiate, seed_match, add_trace_arguments
+from tracing import TRACE_LEVELS, TRACE_SUMMARY, TRACE_TURNS, PrintTrace, JsonlTrace
+from instrumentation import Instrumentation
+from budget import OVERRUN_POLICIES, MoveForfeited, TimeBudget
+from sandbox import Submission, WorkerLimits
+from negotiator_base import MIN_HISTORY_WINDOW
+from results_store import ResultsStore
 
-# read_scenario(parameterfile_name : String) --> (int, list(dict))
-    # Utility function to read in a single scenario from a csv file
-    # Expects a single int on the first line, specifying the iteration limit,
-    # and then an arbitrary number of rows of three comma-separated columns,
-    # specifying the name of each item, its rank (where 1 is best) for negotiator A,
-    # and the same for negotiator B
-def read_scenario(parameterfile_name):
-    # Open the file for reading
-    with open(parameterfile_name, 'r') as parameterfile:
-        # Consume the first line, getting the iteration limit
-        number_iterations = parameterfile.readline()
-        return (
-                int(number_iterations),
-                # Use Python's builtin CSV reader to read the rest of the file as specified
-                list(DictReader(parameterfile, fieldnames=["item_name", "negotiator_a", "negotiator_b"]))
-                )
+# We will replace Negotiator here with <your id>_Negotiator, as specified in the Readme
+negotiators = [BANegotiator, Negotiator, LinearNegotiator, AsymptoticNegotiator, LinearThenAsymptoticNegotiator, FlexibleNegotiator, MeanNegotiator, PseudoRandomNegotiator]
 
-# negotiate(num_iterations :  Int, negotiator_a : BaseNegotiator, negotiator_b : BaseNegotiator) --> (Boolean, list(String), Int)
-    # The main negotiation function, responsible for running a single scenario & coordinating interactions between the two
-    # negotiators.
-def negotiate(num_iterations, negotiator_a, negotiator_b):
-    # Get the initial offer from negotiator a - we pass in None to signify that no previous opposing offers have been made
-    (offer_a, offer_b) = (negotiator_a.make_offer(None), None)
-
-    # We scale the reported utility by a random factor
-    a_scale = randint(1, 11)
-    b_scale = randint(1, 11)
-
-    # Keep trading offers until we reach an agreement or the iteration limit, whichever comes first
-    for i in range(num_iterations):
-        print(offer_a, offer_b)
-
-        # Get from each negotiator the utility it received from the offer it most recently gave
-        utility = (a_scale * negotiator_a.utility(), b_scale * negotiator_b.utility())
-        # Send b the latest offer from a and allow it to rebut
-        negotiator_b.receive_utility(utility[0])
-        offer_b = negotiator_b.make_offer(offer_a)
-
-        # We signify agreement by both offers being structurally equal
-        if offer_a == offer_b:
-            return (True, offer_a, i)
-
-        # If we didn't agree, let a respond to b's offer, recalculate utility and send 'a' the info
-        utility = (a_scale * negotiator_a.utility(), b_scale * negotiator_b.utility())
-        negotiator_a.receive_utility(utility[1])
-        offer_a = negotiator_a.make_offer(offer_b)
-
-        if offer_a == offer_b:
-            return (True, offer_a, i)
-
-
-    # If we failed overall, then there's no ordering to return
-    return (False, None, num_iterations)
+# run_scenario(negotiator_class : type, scenario : String, trace_level : Int, turns_as_jsonl : Boolean, master_seed : Int, cache_dir : String, instrument : Boolean, budget : TimeBudget, history_window : Int, round_history : Boolean, negotiator_a_class : type) --> (dict, Float, Float, String, String, Instrumentation, TimeBudget)
+    # Runs one work unit of the tournament: 10 rounds of negotiator_a_class (AsymptoticNegotiator by default) against
+    # negotiator_class on a single scenario, both fresh instances. Everything the unit reports at trace_level is captured and
+    # returned - per-turn records separately as JSON lines if turns_as_jsonl is set - along with its
+    # summary entry (including every round's results, as given to receive_results) and final scores, so units can run
+    # in any process and still be reported in order. With a master_seed every round is seeded from its own key, so
+    # the unit's results don't depend on where it runs. cache_dir enables the compiled scenario cache (see
+    # load_scenario). With instrument set, every negotiation is measured and the Instrumentation is returned;
+    # otherwise None is. A budget limits the time each negotiator may take to move and is returned with the unit's
+    # overruns recorded in it. history_window and round_history bound what both negotiators remember (see
+    # BaseNegotiator.set_history_limits).
+def run_scenario(negotiator_class, scenario, trace_level=TRACE_SUMMARY, turns_as_jsonl=False, master_seed=None, cache_dir=None, instrument=False, budget=None, history_window=None, round_history=False, negotiator_a_class=AsymptoticNegotiator):
+    instruments = Instrumentation() if instrument else None
+    if instruments is not None:
+        instruments.start_match(scenario)
+    if budget is not None:
+        budget.start_match("{} vs. {} on {}".format(negotiator_a_class.__name__, negotiator_class.__name__, scenario))
+    output = StringIO()
+    turn_records = StringIO()
+    trace = JsonlTrace(turn_records, level=trace_level, out=output) if turns_as_jsonl else PrintTrace(trace_level, out=output)
+    negotiator_a = negotiator_a_class()
+    negotiator_b = negotiator_class()
+    name_a = negotiator_a_class.__name__
+    name_b = negotiator_class.__name__
+    for negotiator in (negotiator_a, negotiator_b):
+        negotiator.set_history_limits(history_window, round_history)
+    trace.start_match("{} vs. {} on {}".format(name_a, name_b, scenario))
+    score_a = score_b = 0
+    # Get the scenario parameters, with each negotiator's preferred item ordering
+    scenario_params = load_scenario(scenario, cache_dir)
+    num_iters = scenario_params.iter_limit
+    # Give each negotiator their preferred item ordering
+    negotiator_a.initialize(scenario_params.a_preferences(), num_iters)
+    negotiator_b.initialize(scenario_params.b_preferences(), num_iters)
+    scenario_summary = {'a':{'wins':0, 'score':0}, 'b': {'wins':0, 'score':0}, 'rounds': []}
+    for i in range(10):
+        # Get the result of the negotiation
+        rng = seed_match(master_seed, negotiator_a, negotiator_b, name_a, name_b, scenario, i)
+        (result, order, count) = negotiate(num_iters, negotiator_a, negotiator_b, trace, rng, instruments, budget)
+        # Assign points to each negotiator. Note that if the negotiation failed, each negotiatior receives a negative penalty
+        # However, it is also possible in a "successful" negotiation for a given negotiator to receive negative points
+        try:
+            (points_a, points_b) = (negotiator_a.utility(), negotiator_b.utility()) if result else (-len(scenario_params), -len(scenario_params))
+        except Exception as error:
+            # A negotiator failed while being scored, so the round fails after all. Outside a budgeted run only a
+            # failed sandbox is expected to fail here; anything else is a bug, and surfaces.
+            if budget is None and not isinstance(error, MoveForfeited):
+                raise
+            trace.summary("Scoring failed: {}: {}".format(error.__class__.__name__, error))
+            (result, points_a, points_b) = (False, -len(scenario_params), -len(scenario_params))
+        results = (result, points_a, points_b, count)
+        scenario_summary['rounds'].append(results)
+        score_a += points_a
+        score_b += points_b
+        # Update each negotiator with the final result, points assigned, and number of iterations taken to reach an agreement
+        for negotiator in (negotiator_a, negotiator_b):
+            try:
+                negotiator.receive_results(results)
+            except Exception as error:
+                # The result stands; the negotiator starts the next round from a clean state
+                if budget is None and not isinstance(error, MoveForfeited):
+                    raise
+                trace.summary("{} failed: {}: {}".format(negotiator.__class__.__name__, error.__class__.__name__, error))
+                negotiator.reset()
+        scenario_summary['a']['wins'] += 1 if score_a > score_b else 0
+        scenario_summary['b']['wins'] += 1 if score_a < score_b else 0
+        trace.summary("Round {}: {}\n\t{}: {}\n\t{}: {}".format(i, "Successful" if result else "Failed", name_a, points_a, name_b, points_b))
+    for negotiator in (negotiator_a, negotiator_b):
+        for failure in getattr(negotiator, "failures", []):
+            trace.summary("Worker failure: {}".format(failure))
+    scenario_summary['a']['score'] += score_a
+    scenario_summary['b']['score'] += score_b
+    trace.summary("Scenario: {}\n\tFinal result:\n\t{}: {}\n\t{}: {}\n\n".format(scenario, name_a, score_a, name_b, score_b))
+    # Closing the trace closes turn_records too, so take its records first
+    trace.flush()
+    records = turn_records.getvalue()
+    trace.close()
+    return (scenario_summary, score_a, score_b, output.getvalue(), records, instruments, budget)
 
 if __name__ == "__main__":
+    parser = ArgumentParser(description="Runs every negotiator against AsymptoticNegotiator on each scenario")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes to spread the (matchup, scenario) units over")
+    add_trace_arguments(parser, "summary")
+    parser.add_argument("--seed", type=int, help="master seed making the run reproducible")
+    parser.add_argument("--instrument", action="store_true", help="time every move and count utility evaluations and shuffles, reported per negotiator and per scenario")
+    parser.add_argument("--move-budget", type=float, help="seconds each negotiator may spend on a single move")
+    parser.add_argument("--match-budget", type=float, help="seconds each negotiator may spend on all its moves in one negotiation")
+    parser.add_argument("--overrun", choices=OVERRUN_POLICIES, default="repeat", help="what happens to a move that runs over budget: repeat the negotiator's last offer, or forfeit the negotiation")
+    parser.add_argument("--history-window", type=int, help="number of past offers, utilities and results each negotiator keeps")
+    parser.add_argument("--round-history", action="store_true", help="clear the negotiators' offer and utility histories after every round")
+    parser.add_argument("--submission", action="append", default=[], help="also run this submission (module.Class, e.g. <your id>.Negotiator) in a sandboxed worker; may be repeated")
+    parser.add_argument("--submission-cpu", type=int, default=10, help="CPU seconds a submission may use per call")
+    parser.add_argument("--submission-memory", type=int, default=1024, help="megabytes of address space a submission's worker may use")
+    parser.add_argument("--submission-timeout", type=float, default=30, help="seconds to wait for a submission to answer before restarting its worker")
+    parser.add_argument("--scenario-cache", help="directory to keep compiled scenarios in, so each csv is only parsed once")
+    parser.add_argument("--results-db", default=":memory:", help="SQLite database to record every match and round in, so the run can be queried afterwards (kept in memory by default)")
+    parser.add_argument("--resume", action="store_true", help="continue the last run of the same negotiators and scenarios recorded in --results-db, playing only the units it is missing")
+    parser.add_argument("scenarios", nargs="*", help="scenario files, in csv format")
+    args = parser.parse_args()
+    trace_level = TRACE_LEVELS[args.trace]
+    trace_file = open(args.trace_file, 'w') if args.trace_file is not None and trace_level >= TRACE_TURNS else None
+    if args.history_window is not None and args.history_window < MIN_HISTORY_WINDOW:
+        parser.error("--history-window must be at least {}".format(MIN_HISTORY_WINDOW))
     # We can't run without at least one scenario. We can, however, run with multiple provided scenarios
-    if len(argv) < 2:
+    if len(args.scenarios) < 1:
         print("Please provide at least one scenario file, in csv format.")
         exit(-42)
-    # We will replace Negotiator here with <your id>_Negotiator, as specified in the Readme
-    negotiators = [BANegotiator, Negotiator, LinearNegotiator, AsymptoticNegotiator, LinearThenAsymptoticNegotiator, FlexibleNegotiator, MeanNegotiator, PseudoRandomNegotiator]
-    summary = {}
-    for negotiator in negotiators:
-        negotiator_a = AsymptoticNegotiator()
-        negotiator_b = negotiator()
-        namestr = "{} vs. {}".format(negotiator_a.__class__.__name__, negotiator_b.__class__.__name__)
-        summary[namestr] = {}
-        for scenario in argv[1:]:
-            score_a = score_b = 0
-            # Get the scenario parameters
-            (num_iters, mapping) = read_scenario(scenario)
-            # Separate the mapping out for each negotiator, and sort the items from it into a list
-            # based upon the preferences of each negotiator
-            a_mapping = {item["item_name"] : int(item["negotiator_a"]) for item in mapping}
-            a_order = sorted(a_mapping, key=a_mapping.get, reverse=True)
-            b_mapping = {item["item_name"] : int(item["negotiator_b"]) for item in mapping}
-            b_order = sorted(b_mapping, key=b_mapping.get, reverse=True)
-            # Give each negotiator their preferred item ordering
-            negotiator_a.initialize(a_order, num_iters)
-            negotiator_b.initialize(b_order, num_iters)
-            summary[namestr][scenario] = {'a':{'wins':0, 'score':0}, 'b': {'wins':0, 'score':0}}
-            for i in range(10):
-                # Get the result of the negotiation
-                (result, order, count) = negotiate(num_iters, negotiator_a, negotiator_b)
-                # Assign points to each negotiator. Note that if the negotiation failed, each negotiatior receives a negative penalty
-                # However, it is also possible in a "successful" negotiation for a given negotiator to receive negative points
-                (points_a, points_b) = (negotiator_a.utility(), negotiator_b.utility()) if result else (-len(a_order), -len(b_order))
-                results = (result, points_a, points_b, count)
-                score_a += points_a
-                score_b += points_b
-                # Update each negotiator with the final result, points assigned, and number of iterations taken to reach an agreement
-                negotiator_a.receive_results(results)
-                negotiator_b.receive_results(results)
-                summary[namestr][scenario]['a']['wins'] += 1 if score_a > score_b else 0
-                summary[namestr][scenario]['b']['wins'] += 1 if score_a < score_b else 0
-                print("Round {}: {}\n\t{}: {}\n\t{}: {}".format(i, "Successful" if result else "Failed", negotiator_a.__class__.__name__, points_a, negotiator_b.__class__.__name__, points_b))
-            summary[namestr][scenario]['a']['score'] += score_a
-            summary[namestr][scenario]['b']['score'] += score_b
-            print("Scenario: {}\n\tFinal result:\n\t{}: {}\n\t{}: {}\n\n".format(scenario, negotiator_a.__class__.__name__,score_a, negotiator_b.__class__.__name__, score_b))
-        print("Final result:\n\tNegotiator A: {}\n\tNegotiator B: {}".format(score_a, score_b))
+    if args.resume and args.results_db == ":memory:":
+        parser.error("--resume needs a --results-db file to resume from")
+    # Each unit gets its own budget to record its overruns in
+    budgeted = args.move_budget is not None or args.match_budget is not None
+    make_budget = lambda: TimeBudget(args.move_budget, args.match_budget, args.overrun) if budgeted else None
+    limits = WorkerLimits(args.submission_cpu, args.submission_memory, args.submission_timeout)
+    entrants = negotiators + [Submission(spec, limits) for spec in args.submission]
+    # Each (matchup, scenario) pair is an independent unit of work
+    units = [(negotiator, scenario, trace_level, trace_file is not None, args.seed, args.scenario_cache, args.instrument, make_budget(), args.history_window, args.round_history) for negotiator in entrants for scenario in args.scenarios]
+    # Units are recorded as they are merged, each committed with its rounds, so a file database checkpoints the run
+    store = ResultsStore(args.results_db, 1 if args.results_db != ":memory:" else 1000)
+    description = "driver.py: {} on {}".format(", ".join(negotiator.__name__ for negotiator in entrants), ", ".join(args.scenarios))
+    resumed = store.resumable_run(description) if args.resume else None
+    if resumed is not None and resumed[1] != args.seed:
+        parser.error("the run to resume was played with --seed {}".format(resumed[1]))
+    run = resumed[0] if resumed is not None else store.start_run(args.seed, description)
+    # Units the run already recorded are skipped; every round's seed comes from its own key, so the rest play out
+    # exactly as they would have without the interruption
+    done = store.completed(run)
+    pending = [(index, unit) for (index, unit) in enumerate(units) if (AsymptoticNegotiator.__name__, unit[0].__name__, unit[1]) not in done]
+    if resumed is not None:
+        print("Resuming run {}: {} of {} units already played".format(run, len(units) - len(pending), len(units)))
+    executor = None
+    if not pending:
+        unit_results = []
+    elif args.jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+        unit_results = executor.map(run_scenario, *zip(*[unit for (index, unit) in pending]))
+    else:
+        unit_results = map(run_scenario, *zip(*[unit for (index, unit) in pending]))
+    # Stream the units into the results store in order, printing each one's report as it completes
+    instruments = Instrumentation() if args.instrument else None
+    overruns = TimeBudget()
+    for ((index, (negotiator, scenario, unit_level, unit_jsonl, unit_seed, unit_cache, unit_instrument, _, _, _)), (scenario_summary, score_a, score_b, output, turn_records, unit_instruments, unit_budget)) in zip(pending, unit_results):
+        store.record_match(run, index, AsymptoticNegotiator.__name__, negotiator.__name__, scenario, scenario_summary)
+        print(output, end="")
+        if trace_file is not None:
+            trace_file.write(turn_records)
+        if instruments is not None:
+            instruments.merge(unit_instruments)
+        if unit_budget is not None:
+            overruns.overruns.extend(unit_budget.overruns)
+        if scenario == args.scenarios[-1] and trace_level >= TRACE_SUMMARY:
+            print("Final result:\n\tNegotiator A: {}\n\tNegotiator B: {}".format(score_a, score_b))
+    if executor is not None:
+        executor.shutdown()
+    if trace_file is not None:
+        trace_file.close()
 
     total_pts_a = 0;
     total_pts_b = 0;
-    for key in summary.keys():
-        print("Summary for {}".format(key, summary[key]))
-        for scen in summary[key].keys():
-            total_pts_a += int(summary[key][scen]['a']['score'])
-            total_pts_b += int(summary[key][scen]['b']['score'])
-            print("\tScenario: {}".format(scen))
-            print("\t\tA\n\t\t\tWins: {}\n\t\t\tScore: {}".format(summary[key][scen]['a']['wins'], summary[key][scen]['a']['score']))
-            print("\t\tB\n\t\t\tWins: {}\n\t\t\tScore: {}\n".format(summary[key][scen]['b']['wins'], summary[key][scen]['b']['score']))
+    namestr = None
+    for (name_a, name_b, scen, score_a, score_b, wins_a, wins_b) in store.matches(run):
+        key = "{} vs. {}".format(name_a, name_b)
+        if key != namestr:
+            namestr = key
+            print("Summary for {}".format(namestr))
+        total_pts_a += int(score_a)
+        total_pts_b += int(score_b)
+        print("\tScenario: {}".format(scen))
+        print("\t\tA\n\t\t\tWins: {}\n\t\t\tScore: {}".format(wins_a, score_a))
+        print("\t\tB\n\t\t\tWins: {}\n\t\t\tScore: {}\n".format(wins_b, score_b))
     print("Total Points for A: " + str(total_pts_a))
     print("Total Points for B: " + str(total_pts_b))
+    store.close()
 
+    if instruments is not None:
+        print(instruments.report())
+    if budgeted:
+        print("Time budget overruns and failures: {}".format(len(overruns.overruns)))
+        if overruns.overruns:
+            print(overruns.report())
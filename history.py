@@ -0,0 +1,196 @@
+from array import array
+from collections import deque
+
+# A sequence of history entries that can be limited to the most recent window entries, so a negotiator that plays
+# many rounds keeps flat memory. Entries keep the index they were appended at (counted since the last clear()):
+# len() is the number appended, and indexing with any of the most recent window indices - or from the end with a
+# negative index - works exactly as on a plain list. Older entries are dropped in chunks, so appending stays O(1).
+class WindowedHistory:
+    def __init__(self, window=None):
+        if window is not None and window < 1:
+            raise ValueError("history window must be at least 1")
+        self.window = window
+        self.clear()
+
+    # clear(self : WindowedHistory)
+        # Forgets every entry, e.g. at the end of a round
+    def clear(self):
+        self.entries = self.new_storage()
+        # Index of self.entries[0]; everything before it has been dropped
+        self.start = 0
+
+    def new_storage(self):
+        return []
+
+    def __len__(self):
+        return self.start + len(self.entries)
+
+    # first_index(self : WindowedHistory) --> Int
+        # Index of the oldest entry still retained
+    def first_index(self):
+        if self.window is None:
+            return self.start
+        return max(self.start, len(self) - self.window)
+
+    # retained(self : WindowedHistory) --> Int
+        # Number of entries still retained
+    def retained(self):
+        return len(self) - self.first_index()
+
+    # locate(self : WindowedHistory, index : Int) --> Int
+        # Position in self.entries of the entry at index, which must still be retained
+    def locate(self, index):
+        if index < 0:
+            index += len(self)
+        if not self.first_index() <= index < len(self):
+            raise IndexError("history index {} is not retained".format(index))
+        return index - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            first = self.first_index()
+            return [self.get(i) for i in range(*index.indices(len(self))) if i >= first]
+        return self.get(index)
+
+    def __iter__(self):
+        for i in range(self.first_index(), len(self)):
+            yield self.get(i)
+
+    def get(self, index):
+        return self.entries[self.locate(index)]
+
+    # push(self : WindowedHistory, entry)
+        # Appends entry, letting the oldest retained entry go if the window is full
+    def push(self, entry):
+        if self.window is not None and self.retained() == self.window:
+            self.dropped(self.entries[self.first_index() - self.start])
+        self.entries.append(entry)
+        if self.window is not None and len(self.entries) >= 2 * self.window:
+            drop = len(self.entries) - self.window
+            del self.entries[:drop]
+            self.start += drop
+
+    # dropped(self : WindowedHistory, entry)
+        # Called with each entry as it leaves the window
+    def dropped(self, entry):
+        pass
+
+# Compact storage for a negotiator's offer history. Offers are interned through an ItemTable (see
+# scenario.py) and kept as the bytes of their arrays of item ids, so a stored offer costs a couple of bytes
+# per item instead of a list of pointers. Repeated offers - which are most of them once a negotiation
+# settles - share one bytes object rather than each storing a copy. Indexing decodes back into a list of
+# item names, which keeps the history usable exactly like the plain lists it replaces.
+class OfferHistory(WindowedHistory):
+    def __init__(self, items, window=None):
+        self.items = items
+        super().__init__(window)
+
+    def clear(self):
+        super().clear()
+        # Each distinct offer retained, as [its stored bytes, number of entries referring to it], by those
+        # same bytes. The first byte is the array typecode of the ids that follow.
+        self.shared = {}
+
+    # append(self : OfferHistory, offer : list(String))
+        # Stores offer in encoded form, sharing the bytes of an identical offer already retained
+    def append(self, offer):
+        if offer is None:
+            self.push(None)
+            return
+        ids = self.items.encode(offer)
+        key = ids.typecode.encode() + ids.tobytes()
+        entry = self.shared.get(key)
+        if entry is None:
+            entry = self.shared[key] = [key, 0]
+        entry[1] += 1
+        self.push(entry[0])
+
+    def dropped(self, key):
+        if key is None:
+            return
+        entry = self.shared[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.shared[key]
+
+    def get(self, index):
+        return self.decode(self.entries[self.locate(index)])
+
+    # get_ids(self : OfferHistory, index : Int) --> memoryview(Int)
+        # Returns the stored offer at index as a read-only view of its item ids, without decoding it or
+        # copying. Encoded offers compare (and hash, via tobytes()) far more cheaply than lists of names.
+    def get_ids(self, index):
+        return self.view(self.entries[self.locate(index)])
+
+    def view(self, key):
+        return memoryview(key)[1:].cast(chr(key[0]))
+
+    def decode(self, key):
+        return None if key is None else self.items.decode(self.view(key))
+
+# A stream of utilities (e.g. their reported utilities, or our utility for each of their offers) stored as
+# doubles, that keeps the aggregates our strategies ask about up to date as values arrive: how many of the
+# retained values were negative, and where their maximum is. Each query is O(1) instead of a scan over the
+# whole history.
+class UtilityHistory(WindowedHistory):
+    def clear(self):
+        super().clear()
+        self.negatives = 0
+        # Indices of the retained values that no later value exceeds, oldest first; the first is the index
+        # of the first occurrence of the maximum
+        self.leaders = deque()
+
+    def new_storage(self):
+        return array('d')
+
+    # best(self : UtilityHistory) --> Float
+        # The largest retained utility, None if there are none
+    def best(self):
+        return self.get(self.leaders[0]) if self.leaders else None
+
+    def append(self, utility):
+        if utility < 0:
+            self.negatives += 1
+        while self.leaders and self.get(self.leaders[-1]) < utility:
+            self.leaders.pop()
+        self.leaders.append(len(self))
+        self.push(utility)
+        if self.leaders[0] < self.first_index():
+            self.leaders.popleft()
+
+    def dropped(self, utility):
+        if utility < 0:
+            self.negatives -= 1
+
+    # negative_ratio(self : UtilityHistory) --> Float
+        # Fraction of the retained utilities that were negative, 0 if there are none yet
+    def negative_ratio(self):
+        retained = self.retained()
+        return self.negatives / retained if retained else 0
+
+    # argmax(self : UtilityHistory, floor : Float) --> Int
+        # Index of the first retained utility holding the maximum, provided the maximum is above floor; -1 otherwise
+    def argmax(self, floor):
+        return self.leaders[0] if self.leaders and self.get(self.leaders[0]) > floor else -1
+
+# The results of past negotiations (see receive_results), keeping count of how often each number of
+# iterations ended in a failure while we were B, so questions like "do they always accept on the last
+# turn?" are answered without rescanning every past result.
+class ResultHistory(WindowedHistory):
+    def clear(self):
+        super().clear()
+        self.failures_as_b = {}
+
+    def append(self, result):
+        if result['was_A'] == False and result['result'] == False:
+            self.failures_as_b[result['iters']] = self.failures_as_b.get(result['iters'], 0) + 1
+        self.push(result)
+
+    def dropped(self, result):
+        if result['was_A'] == False and result['result'] == False:
+            self.failures_as_b[result['iters']] -= 1
+
+    # failed_as_b(self : ResultHistory, iters : Int) --> Int
+        # Number of retained failed negotiations that ended after iters iterations while we were B
+    def failed_as_b(self, iters):
+        return self.failures_as_b.get(iters, 0)
@@ -0,0 +1,179 @@
+from contextlib import contextmanager
+from time import perf_counter
+
+# Opt-in instrumentation for negotiate(). While a negotiation is measured, each negotiator's make_offer, utility,
+# get_utility and rng.shuffle are wrapped on the instance to time every move and count the utility evaluations and
+# shuffles it does, and the hits and misses of its utility cache are counted; afterwards the wrappers are removed
+# again. Nothing is wrapped when instrumentation is off, so an
+# uninstrumented negotiate() pays a single None check.
+
+# Latency histogram buckets: bucket k holds make_offer calls taking less than 2^k microseconds (and at least
+# 2^(k-1), apart from bucket 0)
+def latency_bucket(seconds):
+    micros = seconds * 1e6
+    bucket = 0
+    while micros >= 1 and bucket < 40:
+        micros /= 2
+        bucket += 1
+    return bucket
+
+# Counters for one negotiator over one negotiate() call. Utility evaluations and shuffles are only counted while
+# make_offer is running, so the framework's own calls to utility() don't show up.
+class NegotiatorProbe:
+    def __init__(self, negotiator):
+        self.negotiator = negotiator
+        self.offer_times = []
+        self.utility_calls = 0
+        self.get_utility_calls = 0
+        self.shuffles = 0
+        # Utility cache counters when attached, to count the hits and misses over the negotiation
+        self.cache_counters = self.read_cache_counters()
+        self.in_make_offer = False
+        # (object, attribute name, value it had in the instance's __dict__, or None)
+        self.replaced = []
+
+    # attach(self : NegotiatorProbe)
+        # Wraps the negotiator's methods. Those it doesn't have (a sandboxed negotiator has no get_utility, and no rng
+        # of its own) are left alone.
+    def attach(self):
+        negotiator = self.negotiator
+        make_offer = negotiator.make_offer
+        utility = negotiator.utility
+        get_utility = getattr(negotiator, "get_utility", None)
+        rng = getattr(negotiator, "rng", None)
+        shuffle = getattr(rng, "shuffle", None)
+
+        def timed_make_offer(offer):
+            self.in_make_offer = True
+            start = perf_counter()
+            try:
+                return make_offer(offer)
+            finally:
+                self.offer_times.append(perf_counter() - start)
+                self.in_make_offer = False
+
+        def counted_utility():
+            if self.in_make_offer:
+                self.utility_calls += 1
+            return utility()
+
+        def counted_get_utility(offer):
+            if self.in_make_offer:
+                self.get_utility_calls += 1
+            return get_utility(offer)
+
+        def counted_shuffle(ordering):
+            if self.in_make_offer:
+                self.shuffles += 1
+            return shuffle(ordering)
+
+        self.replace(negotiator, "make_offer", timed_make_offer)
+        self.replace(negotiator, "utility", counted_utility)
+        if get_utility is not None:
+            self.replace(negotiator, "get_utility", counted_get_utility)
+        if shuffle is not None:
+            self.replace(rng, "shuffle", counted_shuffle)
+
+    # read_cache_counters(self : NegotiatorProbe) --> (Int, Int)
+        # The negotiator's utility cache hits and misses so far (see BaseNegotiator.get_utility), or zeros if it
+        # has no cache, e.g. when it is sandboxed
+    def read_cache_counters(self):
+        return (getattr(self.negotiator, "utility_cache_hits", 0), getattr(self.negotiator, "utility_cache_misses", 0))
+
+    # cache_counts(self : NegotiatorProbe) --> (Int, Int)
+        # Utility cache hits and misses since the probe was created
+    def cache_counts(self):
+        (hits, misses) = self.read_cache_counters()
+        return (hits - self.cache_counters[0], misses - self.cache_counters[1])
+
+    def replace(self, target, name, wrapper):
+        self.replaced.append((target, name, target.__dict__.get(name)))
+        setattr(target, name, wrapper)
+
+    def detach(self):
+        for (target, name, previous) in reversed(self.replaced):
+            if previous is None:
+                delattr(target, name)
+            else:
+                setattr(target, name, previous)
+        self.replaced = []
+
+# Aggregated measurements, keyed by (negotiator class name, scenario). Instances from separate processes can be
+# combined with merge().
+class Instrumentation:
+    def __init__(self):
+        self.stats = {}
+        # Scenario that the next measured negotiations belong to
+        self.scenario = None
+
+    # start_match(self : Instrumentation, scenario : String)
+        # Labels the negotiations measured from now on
+    def start_match(self, scenario):
+        self.scenario = scenario
+
+    # measure(self : Instrumentation, negotiator_a : BaseNegotiator, negotiator_b : BaseNegotiator)
+        # Context manager that instruments both negotiators for its duration and records the results
+    @contextmanager
+    def measure(self, negotiator_a, negotiator_b):
+        probes = [NegotiatorProbe(negotiator_a), NegotiatorProbe(negotiator_b)]
+        try:
+            for probe in probes:
+                probe.attach()
+            yield probes
+        finally:
+            for probe in probes:
+                probe.detach()
+                self.record(probe)
+
+    def record(self, probe):
+        key = (probe.negotiator.__class__.__name__, self.scenario)
+        stats = self.stats.setdefault(key, {'calls': 0, 'time': 0, 'utility': 0, 'get_utility': 0, 'shuffles': 0, 'cache_hits': 0, 'cache_misses': 0, 'histogram': {}})
+        stats['calls'] += len(probe.offer_times)
+        stats['time'] += sum(probe.offer_times)
+        stats['utility'] += probe.utility_calls
+        stats['get_utility'] += probe.get_utility_calls
+        stats['shuffles'] += probe.shuffles
+        (hits, misses) = probe.cache_counts()
+        stats['cache_hits'] += hits
+        stats['cache_misses'] += misses
+        for seconds in probe.offer_times:
+            bucket = latency_bucket(seconds)
+            stats['histogram'][bucket] = stats['histogram'].get(bucket, 0) + 1
+
+    # merge(self : Instrumentation, other : Instrumentation)
+        # Adds other's measurements into this one
+    def merge(self, other):
+        for (key, other_stats) in other.stats.items():
+            self.combine(self.stats.setdefault(key, {'calls': 0, 'time': 0, 'utility': 0, 'get_utility': 0, 'shuffles': 0, 'cache_hits': 0, 'cache_misses': 0, 'histogram': {}}), other_stats)
+
+    def combine(self, stats, other_stats):
+        for field in ('calls', 'time', 'utility', 'get_utility', 'shuffles', 'cache_hits', 'cache_misses'):
+            stats[field] += other_stats[field]
+        for (bucket, count) in other_stats['histogram'].items():
+            stats['histogram'][bucket] = stats['histogram'].get(bucket, 0) + count
+
+    # grouped(self : Instrumentation, by_scenario : Boolean) --> dict
+        # Measurements summed per negotiator class, or per scenario if by_scenario is set
+    def grouped(self, by_scenario):
+        groups = {}
+        for ((class_name, scenario), stats) in self.stats.items():
+            group = groups.setdefault(scenario if by_scenario else class_name, {'calls': 0, 'time': 0, 'utility': 0, 'get_utility': 0, 'shuffles': 0, 'cache_hits': 0, 'cache_misses': 0, 'histogram': {}})
+            self.combine(group, stats)
+        return groups
+
+    # report(self : Instrumentation) --> String
+        # make_offer latency histograms and operation counts, per negotiator class and then per scenario
+    def report(self):
+        lines = []
+        for (title, by_scenario) in (("negotiator", False), ("scenario", True)):
+            for (name, stats) in self.grouped(by_scenario).items():
+                calls = stats['calls']
+                lines.append("Instrumentation for {} {}".format(title, name))
+                lines.append("\tmake_offer calls: {}, mean {:.1f} us".format(calls, stats['time'] / calls * 1e6 if calls else 0))
+                lines.append("\tper call: {:.1f} utility, {:.1f} get_utility, {:.1f} shuffles".format(*(stats[field] / calls if calls else 0 for field in ('utility', 'get_utility', 'shuffles'))))
+                lookups = stats['cache_hits'] + stats['cache_misses']
+                lines.append("\tutility cache: {} hits, {} misses ({:.1f}% hit rate)".format(stats['cache_hits'], stats['cache_misses'], 100 * stats['cache_hits'] / lookups if lookups else 0))
+                for bucket in sorted(stats['histogram']):
+                    count = stats['histogram'][bucket]
+                    lines.append("\t\t< {:>9} us: {:>7} {}".format(2 ** bucket, count, "#" * max(1, int(40 * count / calls))))
+        return "\n".join(lines)
@@ -0,0 +1,126 @@
+from argparse import ArgumentParser
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from os import cpu_count
+from driver import negotiators, run_scenario
+from scenario import load_scenario
+from sandbox import Submission, WorkerLimits
+from agent_runtime import load_negotiator_class
+from tracing import TRACE_LEVELS, TRACE_SUMMARY
+from results_store import ResultsStore
+
+# A full round-robin league. Every negotiator plays every other one on every scenario, once as A and once as B, each
+# match being one work unit of driver.py (10 rounds on one scenario, see run_scenario). Matches are dispatched
+# longest-first to an executor, so the long ones start early and the short ones fill in the gaps at the end, and the
+# results are recorded in a ResultsStore and ranked into a standings table from there.
+
+EXECUTORS = ("process", "thread", "serial")
+
+# Runs everything submitted to it immediately, in the calling thread
+class SerialExecutor(Executor):
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as error:
+            future.set_exception(error)
+        return future
+
+# make_executor(kind : String, jobs : Int) --> Executor
+def make_executor(kind, jobs):
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=jobs)
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=jobs)
+    return SerialExecutor()
+
+# load_entrant(spec : String, sandbox : Boolean, limits : WorkerLimits) --> type
+    # The negotiator named by spec (module.Class): its class, or with sandbox set a Submission running it in a worker
+def load_entrant(spec, sandbox=False, limits=None):
+    if sandbox:
+        return Submission(spec, limits)
+    return load_negotiator_class(spec)
+
+# estimate_cost(scenario : Scenario) --> Int
+    # Rough relative cost of a match on scenario: every negotiator's moves grow at least with the number of items,
+    # and there are up to iter_limit of them per round
+def estimate_cost(scenario):
+    return scenario.iter_limit * len(scenario)
+
+# schedule(entrants : list(type), scenarios : list(String), self_play : Boolean, cache_dir : String) --> list((type, type, String))
+    # Every match of the league as (A, B, scenario), costliest first. With self_play each entrant also plays itself.
+def schedule(entrants, scenarios, self_play=False, cache_dir=None):
+    costs = {scenario: estimate_cost(load_scenario(scenario, cache_dir)) for scenario in scenarios}
+    matches = [(a, b, scenario) for scenario in scenarios for a in entrants for b in entrants if self_play or a is not b]
+    matches.sort(key=lambda match: costs[match[2]], reverse=True)
+    return matches
+
+# standings_report(standings : list((String, Float, Int, Int, Int, Int))) --> String
+    # Formats the ranked rows of ResultsStore.standings as a table
+def standings_report(standings):
+    width = max([len("Negotiator")] + [len(row[0]) for row in standings])
+    lines = ["{:>4}  {:<{width}}  {:>12}  {:>7}  {:>5}  {:>5}  {:>5}".format("Rank", "Negotiator", "Points", "Matches", "Won", "Drawn", "Lost", width=width)]
+    for (rank, (name, points, matches, won, drawn, lost)) in enumerate(standings, 1):
+        lines.append("{:>4}  {:<{width}}  {:>12.2f}  {:>7}  {:>5}  {:>5}  {:>5}".format(rank, name, points, matches, won, drawn, lost, width=width))
+    return "\n".join(lines)
+
+# run_league(entrants : list(type), scenarios : list(String), executor : Executor, store : ResultsStore, names : dict, self_play : Boolean, master_seed : Int, trace_level : Int, cache_dir : String, run : Int) --> (Int, list(String))
+    # Plays the whole league on executor, recording every match in store as it completes. names gives the name each
+    # entrant is listed under (its __name__ by default). Given the id of an earlier, interrupted run of the same
+    # league, only the matches it hasn't recorded are played, into that run. Returns the run's id in store and the
+    # report of every match played, in schedule order (None for those skipped).
+def run_league(entrants, scenarios, executor, store, names=None, self_play=False, master_seed=None, trace_level=TRACE_SUMMARY, cache_dir=None, run=None):
+    names = names if names is not None else {}
+    matches = schedule(entrants, scenarios, self_play, cache_dir)
+    if run is None:
+        run = store.start_run(master_seed, league_description(entrants, scenarios, names, self_play))
+    done = store.completed(run)
+    futures = {executor.submit(run_scenario, b, scenario, trace_level, False, master_seed, cache_dir, negotiator_a_class=a): index for (index, (a, b, scenario)) in enumerate(matches) if (names.get(a, a.__name__), names.get(b, b.__name__), scenario) not in done}
+    outputs = [None] * len(matches)
+    for future in as_completed(futures):
+        index = futures[future]
+        (a, b, scenario) = matches[index]
+        (scenario_summary, score_a, score_b, output, turn_records, instruments, budget) = future.result()
+        store.record_match(run, index, names.get(a, a.__name__), names.get(b, b.__name__), scenario, scenario_summary)
+        outputs[index] = output
+    return (run, outputs)
+
+# league_description(entrants : list(type), scenarios : list(String), names : dict, self_play : Boolean) --> String
+    # What a league's run is recorded as, so that it is only ever resumed by the same league
+def league_description(entrants, scenarios, names=None, self_play=False):
+    names = names if names is not None else {}
+    return "league.py{}: {} on {}".format(" (self-play)" if self_play else "", ", ".join(names.get(entrant, entrant.__name__) for entrant in entrants), ", ".join(scenarios))
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Plays every negotiator against every other on each scenario, as both A and B, and ranks them")
+    parser.add_argument("scenarios", nargs="+", help="scenario files, in csv format")
+    parser.add_argument("--entrant", action="append", default=[], help="negotiator to enter, as module.Class (e.g. <your id>.Negotiator); may be repeated. Defaults to the negotiators in driver.py")
+    parser.add_argument("--sandbox", action="store_true", help="run the --entrant negotiators in sandboxed workers (see sandbox.py)")
+    parser.add_argument("--self-play", action="store_true", help="also play each negotiator against itself")
+    parser.add_argument("--executor", choices=EXECUTORS, default="process", help="how to run matches in parallel")
+    parser.add_argument("-j", "--jobs", type=int, default=cpu_count(), help="number of matches to run at once")
+    parser.add_argument("--seed", type=int, help="master seed making the run reproducible")
+    parser.add_argument("--trace", choices=sorted(TRACE_LEVELS), default="off", help="off: standings only, summary: also each match's rounds, turns: also every offer exchanged")
+    parser.add_argument("--scenario-cache", help="directory to keep compiled scenarios in, so each csv is only parsed once")
+    parser.add_argument("--results-db", default=":memory:", help="SQLite database to record every match and round in, so the league can be queried afterwards (kept in memory by default)")
+    parser.add_argument("--resume", action="store_true", help="continue the last run of the same league recorded in --results-db, playing only the matches it is missing")
+    args = parser.parse_args()
+    if args.resume and args.results_db == ":memory:":
+        parser.error("--resume needs a --results-db file to resume from")
+
+    limits = WorkerLimits()
+    entrants = [load_entrant(spec, args.sandbox, limits) for spec in args.entrant] or negotiators
+    # Entrants given on the command line are listed as given, so two students' Negotiator classes stay apart
+    names = dict(zip(entrants, args.entrant))
+    executor = make_executor(args.executor, args.jobs)
+    # With a file database every match is committed as it completes, checkpointing the league
+    store = ResultsStore(args.results_db, 1 if args.results_db != ":memory:" else 1000)
+    resumed = store.resumable_run(league_description(entrants, args.scenarios, names, args.self_play)) if args.resume else None
+    if resumed is not None and resumed[1] != args.seed:
+        parser.error("the league to resume was played with --seed {}".format(resumed[1]))
+    (run, outputs) = run_league(entrants, args.scenarios, executor, store, names, args.self_play, args.seed, TRACE_LEVELS[args.trace], args.scenario_cache, resumed[0] if resumed is not None else None)
+    executor.shutdown()
+    for output in outputs:
+        if output is not None:
+            print(output, end="")
+    print(standings_report(store.standings(run)))
+    store.close()
@@ -1,6 +1,10 @@
 from negotiator_base import BaseNegotiator
-from random import random, shuffle
-from functools import reduce
+from running_stats import RunningRegression
+
+# BANegotiator's search for an acceptable offer (see calc_new_offer): random shuffles, up to about this many items
+# shuffled in all, then this many random swaps per item away from our preferences
+SHUFFLE_ITEMS = 12000
+WANDER_STEPS_PER_ITEM = 2
 
 # Example negotiator implementation, which randomly chooses to accept
 # an offer or return with a randomized counteroffer.
@@ -11,17 +15,38 @@ class Negotiator(BaseNegotiator):
     # Override the make_offer method from BaseNegotiator to accept a given offer 5%
     # of the time, and return a random permutation the rest of the time.   
     def make_offer(self, offer):
-        if random() < 0.05 and offer:
+        if self.rng.random() < 0.05 and offer:
             # Very important - we save the offer we're going to return as self.offer
             self.offer = offer[:]
             return offer
         else:
             ordering = self.preferences[:]
-            shuffle(ordering)
+            self.rng.shuffle(ordering)
             self.offer = ordering[:]
             return self.offer
 
 class BANegotiator(BaseNegotiator):
+    # trend_window limits the trend detection to their most recent reported utilities; by default the
+    # trend covers everything they have reported
+    def __init__(self, trend_window=None):
+        super().__init__()
+        # Running least-squares fit of their reported utilities over time
+        self.utility_trend = RunningRegression(trend_window)
+
+    def reset(self):
+        trend_window = self.utility_trend.window
+        super().reset()
+        self.utility_trend = RunningRegression(trend_window)
+
+    def receive_utility(self, utility):
+        super().receive_utility(utility)
+        self.utility_trend.add(utility)
+
+    def end_round(self):
+        super().end_round()
+        # The trend follows their reported utilities, so it starts over with them
+        if self.history_per_round:
+            self.utility_trend = RunningRegression(self.utility_trend.window)
 
     def make_offer(self, offer):
         if offer is None:
@@ -104,54 +129,25 @@ class BANegotiator(BaseNegotiator):
     def hes_aggressive(self):
         if len(self.my_past_t_utility) == 0:
             return False
-        bad_utils = 0
-        for util in self.my_past_t_utility:
-            bad_utils += 1 if util < 0 else 0
-        return (bad_utils / len(self.my_past_t_utility)) >= .75
+        return self.my_past_t_utility.negative_ratio() >= .75
 
     def calc_counter_aggressive_offer(self):
-        ind = -1
-        m = 0
-        for i in range(len(self.my_past_t_utility)):
-            if self.my_past_t_utility[i] > m:
-                m = self.my_past_t_utility[i]
-                ind = i
-        best_offer = self.their_past_offers[ind][:]
-        fav_index = best_offer.index(self.preferences[0])
-        # Bubble our favorite item up to the front
-        while fav_index > 0:
-            temp = best_offer[fav_index-1]
-            best_offer[fav_index-1] = best_offer[fav_index]
-            best_offer[fav_index] = temp
-            fav_index -= 1
-
-        snd_fav_index = best_offer.index(self.preferences[1])
-        # Bubble second favorite up to the top
-
-        while snd_fav_index > 1:
-            temp = best_offer[snd_fav_index-1]
-            best_offer[snd_fav_index-1] = best_offer[snd_fav_index]
-            best_offer[snd_fav_index] = temp
-            snd_fav_index -= 1
-
-        return best_offer
+        ind = self.my_past_t_utility.argmax(0)
+        best_offer = self.incremental_offer(self.their_past_offers[ind])
+        # Move our favorite item up to the front
+        best_offer.move(best_offer.items.index(self.preferences[0]), 0)
+        # Move second favorite up to the top
+        snd_fav_index = best_offer.items.index(self.preferences[1])
+        if snd_fav_index > 1:
+            best_offer.move(snd_fav_index, 1)
+        return best_offer.offer()
 
     def calc_friendly_offer(self):
-        ind = -1
-        m = 0
-        for i in range(len(self.my_past_t_utility)):
-            if self.my_past_t_utility[i] > m:
-                m = self.my_past_t_utility[i]
-                ind = i
-        best_offer = self.their_past_offers[ind][:]
-        fav_index = best_offer.index(self.preferences[0])
-        # Bubble our favorite item up to the front
-        while fav_index > 0:
-            temp = best_offer[fav_index-1]
-            best_offer[fav_index-1] = best_offer[fav_index]
-            best_offer[fav_index] = temp
-            fav_index -= 1
-        return best_offer
+        ind = self.my_past_t_utility.argmax(0)
+        best_offer = self.incremental_offer(self.their_past_offers[ind])
+        # Move our favorite item up to the front
+        best_offer.move(best_offer.items.index(self.preferences[0]), 0)
+        return best_offer.offer()
 
     def check_always_accepts_last(self):
         # If there was ever an instance where they were A and they did not accept on the
@@ -160,20 +156,23 @@ class BANegotiator(BaseNegotiator):
         # bot accepts an offer on the last turn.
         if len(self.past_results) == 0:
             return False
-        for item in self.past_results:
-            if item['was_A'] == False and item['result'] == False and item['iters'] == self.iter_limit-1:
-                return False
-        return True
+        return self.past_results.failed_as_b(self.iter_limit-1) == 0
 
     def calc_new_offer(self):
+        goal = .4 * self.max_utility
         offer = self.preferences[:]
-        still_looking = True
-        while still_looking:
-            shuffle(offer)
-            util = self.get_utility(offer)
-            if util > .4 * self.max_utility:
-                still_looking = False
-        return offer
+        for shuffles in range(min(1000, SHUFFLE_ITEMS // len(offer))):
+            self.rng.shuffle(offer)
+            # Scored directly rather than through get_utility, so the one-off shuffles don't push
+            # everything else out of the utility cache
+            util = self.offer_utility(offer)
+            if util > goal:
+                return offer
+        # Random search is taking too long (large or tight scenario) - concede from our preferences
+        # instead, by random swaps that keep the offer above the threshold, at O(1) each
+        concession = self.incremental_offer()
+        concession.wander(self.rng, WANDER_STEPS_PER_ITEM * len(offer), goal)
+        return concession.offer()
 
     def calc_new_offer2(self):
         # We will gradually relax on the offers that we are giving.
@@ -181,51 +180,26 @@ class BANegotiator(BaseNegotiator):
         relax_coefficient = int(self.relax_factor * self.past_iters) + 1
         # relax_coefficient = 1 if relax_coefficient == 0 else relax_coefficient
         right_half = ordering[-relax_coefficient:]
-        shuffle(right_half)
+        self.rng.shuffle(right_half)
         ordering[-relax_coefficient:] = right_half
         util = self.get_utility(ordering)
         return ordering
 
+    # calc_regression(self) --> (Float, Float)
+        # Slope of the trend in their reported utilities, along with their first reported utility,
+        # read off the running fit that receive_utility maintains
     def calc_regression(self):
-        mean_y = reduce(lambda tot, elem: tot + elem, self.their_past_utilities, 0) / len(self.their_past_utilities)
-        mean_x = reduce(lambda tot, elem: tot + elem, [i for i in range(len(self.their_past_utilities))], 0) / len(self.their_past_utilities)
-        numerator = 0
-        denom = 0
-        y_int = self.their_past_utilities[0] if len(self.their_past_utilities) else 0
-        for i in range(len(self.their_past_utilities)):
-            n = (i-mean_x) * (self.their_past_utilities[i]-mean_y)
-            d = (i-mean_x) ** 2
-            numerator += n
-            denom += d
-        denom = 1 if denom == 0 else denom
-        slope = numerator / denom
-        return (slope, y_int)
+        return (self.utility_trend.slope(), self.utility_trend.first())
 
     def calc_regression_expectation(self):
         slope, y_int = self.calc_regression()
-        if len(self.their_past_utilities):
-            next_utility = self.their_past_utilities[0] + slope*len(self.their_past_utilities)
+        if len(self.utility_trend):
+            next_utility = y_int + slope*len(self.utility_trend)
             return next_utility
         return None
 
     def calc_r_squared(self, slope=None, y_int=None):
-        slope, y_int = self.calc_regression() if slope is None or y_int is None else (slope, y_int)
-        sum_x = sum([i for i in range(len(self.their_past_utilities))])
-        sum_x2 = sum([i**2 for i in range(len(self.their_past_utilities))])
-        sum_y = sum([i for i in self.their_past_utilities])
-        sum_y2 = sum([i**2 for i in self.their_past_utilities])
-        zipped = zip(self.their_past_utilities, [i for i in range(len(self.their_past_utilities))])
-        sum_xy = sum([util[0] * util[1] for util in zipped])
-        nom = (len(self.their_past_utilities)*sum_xy) - (sum_x * sum_y)
-        denom1 = (len(self.their_past_utilities)*sum_x2 - (sum_x**2))**0.5
-        inter = len(self.their_past_utilities) * sum_y2 - (sum_y**2)
-        inter = 0 if inter < 0 else inter
-        denom2 = inter**0.5
-        denom = denom1*denom2
-        denom = 1 if denom == 0 else denom
-        r = nom / denom
-        r2 = r*r
-        return r2
+        return self.utility_trend.r_squared()
 
     def should_accept_offer_casual(self, offer):
         utility_to_me = self.get_utility(offer)
@@ -249,5 +223,5 @@ class BANegotiator(BaseNegotiator):
         res['was_A'] = self.is_A
         res['did_win'] = res['my_points'] > res['their_points']
         res['iters'] = results[3]
-        self.past_iters = 0
+        self.end_round()
         self.past_results.append(res)
\ No newline at end of file
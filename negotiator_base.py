@@ -1,4 +1,17 @@
-from functools import reduce
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from collections import OrderedDict
+from random import Random
+from scenario import ItemTable
+from history import OfferHistory, UtilityHistory, ResultHistory
+from assignment import ranked_assignments
+from offer_search import IncrementalOffer
+
+MIN_HISTORY_WINDOW = 2
+# Number of offers whose utility get_utility remembers (see get_utility)
+UTILITY_CACHE_SIZE = 256
 
 class BaseNegotiator:
     # Constructor - Note that you can add other fields here; the only 
@@ -7,18 +20,13 @@ class BaseNegotiator:
         self.preferences = []
         self.offer = []
         self.iter_limit = 0
-        # Their past offers
-        self.their_past_offers = []
-        # Their past utilities to offers that I have received
-        self.their_past_utilities = []
-        # Our utility to their offers
-        self.my_past_t_utility = []
-        # My past offers sent
-        self.my_past_offers = []
-        # My utility to my past sent offers
-        self.my_past_utilities = []
-        # Past results
-        self.past_results = []
+        # Source of randomness for this negotiator's strategy. The framework replaces it with a seeded
+        # stream for every match, so results are reproducible no matter what order matches run in.
+        self.rng = Random()
+        # Interned item ids, shared by the offer histories
+        self.items = ItemTable()
+        # Offer, utility and result histories (see set_history_limits)
+        self.set_history_limits()
         self.past_iters = 0
         # Scaling factor for loosening aggression over time
         self.scaling_factor = 0
@@ -32,7 +40,40 @@ class BaseNegotiator:
         self.min_threshold = 0
         self.linear_threshold_decrease_amt = 0
         # self.exponential_threshold_decrease_amt = 0
-        self.past_trends = []
+        # Precomputed utility tables for the current preferences (see build_utility_table)
+        self.item_ranks = {}
+        self.position_weights = []
+        self.score_table = None
+        self.ranked_offer_stream = None
+        # Utilities of recently scored offers, least recently used first, and how often they were (not) found there
+        self.utility_cache = OrderedDict()
+        self.utility_cache_size = UTILITY_CACHE_SIZE
+        self.utility_cache_hits = 0
+        self.utility_cache_misses = 0
+
+    # set_history_limits(self : BaseNegotiator, window : Int, per_round : Boolean)
+        # (Re)creates the histories, empty. Each keeps only its most recent window entries, or everything if
+        # window is None. With per_round set the offer and utility histories are also cleared at the end of
+        # every round (see end_round); past results are kept across rounds either way. The strategies compare
+        # their latest utilities with the ones before, so a window must hold at least MIN_HISTORY_WINDOW entries.
+    def set_history_limits(self, window=None, per_round=False):
+        if window is not None and window < MIN_HISTORY_WINDOW:
+            raise ValueError("history window must be at least {}".format(MIN_HISTORY_WINDOW))
+        self.history_per_round = per_round
+        # Their past offers
+        self.their_past_offers = OfferHistory(self.items, window)
+        # Their past utilities to offers that I have received
+        self.their_past_utilities = UtilityHistory(window)
+        # Our utility to their offers
+        self.my_past_t_utility = UtilityHistory(window)
+        # My past offers sent
+        self.my_past_offers = OfferHistory(self.items, window)
+        # My utility to my past sent offers
+        self.my_past_utilities = UtilityHistory(window)
+        # Trend in their reported utilities, for the threshold strategies
+        self.past_trends = UtilityHistory(window)
+        # Past results
+        self.past_results = ResultHistory(window)
 
     # initialize(self : BaseNegotiator, preferences : list(String), iter_limit : Int)
         # Performs per-round initialization - takes in a list of items, ordered by the item's
@@ -41,10 +82,28 @@ class BaseNegotiator:
     def initialize(self, preferences, iter_limit):
         self.preferences = preferences
         self.iter_limit = iter_limit
+        # Don't carry an offer over from a previous scenario
+        self.offer = []
+        for item in preferences:
+            self.items.intern(item)
+        self.build_utility_table()
         self.scaling_factor = 1 / self.iter_limit
         self.max_utility = self.get_utility(self.preferences[:])
         self.relax_factor = len(self.preferences) / iter_limit
 
+    # reset(self : BaseNegotiator)
+        # Forgets everything, leaving the negotiator as if it had just been created and initialized with the same
+        # preferences, history limits and random stream. Used when one of its moves failed part way (see
+        # negotiate), since its state may then be inconsistent.
+    def reset(self):
+        (preferences, iter_limit, rng) = (self.preferences, self.iter_limit, self.rng)
+        (window, per_round) = (self.their_past_offers.window, self.history_per_round)
+        self.__init__()
+        self.rng = rng
+        self.set_history_limits(window, per_round)
+        if preferences:
+            self.initialize(preferences, iter_limit)
+
     # make_offer(self : BaseNegotiator, offer : list(String)) --> list(String)
         # Given the opposing negotiator's last offer (represented as an ordered list), 
         # return a new offer. If you wish to accept an offer & end negotiations, return the same offer
@@ -54,8 +113,118 @@ class BaseNegotiator:
     # utility(self : BaseNegotiator) --> Float
         # Return the utility given by the last offer - Do not modify this method.
     def utility(self):
+        return self.offer_utility(self.offer)
+
+    # offer_utility(self : BaseNegotiator, offer : list(String)) --> Float
+        # The utility of any offer to us, computed from the precomputed tables
+    def offer_utility(self, offer):
+        if len(self.position_weights) != len(self.preferences):
+            self.build_utility_table()
+        ranks = self.item_ranks
+        weights = self.position_weights
+        points = 0
+        for pos, item in enumerate(offer):
+            points += weights[pos] - abs(pos - ranks[item])
+        return points
+
+    # build_utility_table(self : BaseNegotiator)
+        # Precomputes everything utility() needs for the current preferences: a map from each item
+        # to its rank, and the weight total / (pos + 1) of each offer position. Each item then scores
+        # weight[pos] - |pos - rank|, so an evaluation is a single pass over the offer. Utilities cached for
+        # the previous preferences are dropped.
+    def build_utility_table(self):
+        self.utility_cache.clear()
         total = len(self.preferences)
-        return reduce(lambda points, item: points + ((total / (self.offer.index(item) + 1)) - abs(self.offer.index(item) - self.preferences.index(item))), self.offer, 0)
+        self.item_ranks = {item: rank for rank, item in enumerate(self.preferences)}
+        self.position_weights = [total / (pos + 1) for pos in range(total)]
+        self.score_table = None
+        self.ranked_offer_stream = None
+
+    # get_score_table(self : BaseNegotiator) --> list(list(Float))
+        # Returns the item x position score table, where score_table[rank][pos] is the points the
+        # item of the given rank earns at position pos. Built on first use and cached until the next
+        # initialize(), since it is quadratic in the number of items.
+    def get_score_table(self):
+        if self.score_table is None:
+            if len(self.position_weights) != len(self.preferences):
+                self.build_utility_table()
+            self.score_table = self.build_score_table(range(len(self.preferences)))
+        return self.score_table
+
+    # build_score_table(self : BaseNegotiator, ranks : list(Int)) --> list(list(Float))
+        # Builds an item x position score table for any preference ordering, where ranks[id] is the
+        # rank of item id (see encode_offer) in that ordering
+    def build_score_table(self, ranks):
+        weights = self.position_weights
+        return [[weight - abs(pos - rank) for pos, weight in enumerate(weights)] for rank in ranks]
+
+    # offer_from_positions(self : BaseNegotiator, positions : list(Int)) --> list(String)
+        # Builds the offer that puts item id at position positions[id], e.g. from a solved assignment
+    def offer_from_positions(self, positions):
+        offer = [None] * len(positions)
+        for item_id, pos in enumerate(positions):
+            offer[pos] = self.preferences[item_id]
+        return offer
+
+    # ranked_offers(self : BaseNegotiator, low : Float) --> generator(list(String))
+        # Yields offers in exactly descending order of our utility, optionally stopping below low. Offers
+        # are enumerated as k-best solutions of the assignment problem over the score table (see
+        # ranked_assignments), so each one after the first costs up to n - 1 O(n^3) assignment solves:
+        # fine for a handful of offers, far too slow as a per-turn search on large scenarios.
+    def ranked_offers(self, low=None):
+        for (value, positions) in ranked_assignments(self.get_score_table(), low):
+            yield self.offer_from_positions(positions)
+
+    # next_ranked_offer(self : BaseNegotiator, low : Float) --> list(String)
+        # Returns our next best offer with utility of at least low, continuing from the previous call
+        # (see ranked_offers). Once the band is used up we fall back to our own preferences.
+    def next_ranked_offer(self, low=None):
+        if self.ranked_offer_stream is None or self.ranked_offer_stream[0] != low:
+            self.ranked_offer_stream = (low, self.ranked_offers(low))
+        return next(self.ranked_offer_stream[1], self.preferences[:])
+
+    # incremental_offer(self : BaseNegotiator, offer : list(String), utility : Float) --> IncrementalOffer
+        # A copy of offer (our preferences if None) that keeps track of its utility to us as items are swapped and
+        # moved, for local search (see offer_search.py). utility can be given if it is already known.
+    def incremental_offer(self, offer=None, utility=None):
+        if len(self.position_weights) != len(self.preferences):
+            self.build_utility_table()
+        return IncrementalOffer(self.preferences if offer is None else offer, self.item_ranks, self.position_weights, utility)
+
+    # encode_offer(self : BaseNegotiator, offer : list(String)) --> list(Int)
+        # Converts an offer into a list of item ids, where an item's id is its rank in self.preferences
+    def encode_offer(self, offer):
+        ranks = self.item_ranks
+        return [ranks[item] for item in offer]
+
+    # decode_offer(self : BaseNegotiator, ids : list(Int)) --> list(String)
+        # Converts a list of item ids (see encode_offer) back into an offer
+    def decode_offer(self, ids):
+        return [self.preferences[i] for i in ids]
+
+    # get_utilities(self : BaseNegotiator, candidates : 2-D array(Int)) --> list(Float)
+        # Returns the utility of every candidate offer at once. Each row of candidates is a
+        # permutation of item ids (see encode_offer).
+    def get_utilities(self, candidates):
+        return self.score_candidates(candidates)
+
+    # score_candidates(self : BaseNegotiator, candidates : 2-D array(Int), ranks : list(Int)) --> list(Float)
+        # Scores each row of candidates against a preference ordering, where ranks[id] is the rank of
+        # item id in that ordering (our own preferences if ranks is None). Uses one vectorized NumPy
+        # pass when NumPy is installed, and the precomputed tables row by row otherwise.
+    def score_candidates(self, candidates, ranks=None):
+        if len(self.position_weights) != len(self.preferences):
+            self.build_utility_table()
+        weights = self.position_weights
+        if np is not None:
+            rows = np.asarray(candidates, dtype=np.intp).reshape(-1, len(weights))
+            if ranks is not None:
+                rows = np.asarray(ranks, dtype=np.intp)[rows]
+            positions = np.arange(len(weights))
+            return (np.asarray(weights) - np.abs(positions - rows)).sum(axis=1).tolist()
+        if ranks is None:
+            return [sum(weights[pos] - abs(pos - item) for pos, item in enumerate(row)) for row in candidates]
+        return [sum(weights[pos] - abs(pos - ranks[item]) for pos, item in enumerate(row)) for row in candidates]
 
     # receive_utility(self : BaseNegotiator, utility : Float)
         # Store the utility the other negotiator received from their last offer
@@ -65,14 +234,37 @@ class BaseNegotiator:
     # receive_results(self : BaseNegotiator, results : (Boolean, Float, Float, Int))
         # Store the results of the last series of negotiation (points won, success, etc.)
     def receive_results(self, results):
-        pass
+        self.end_round()
         # self.past_results.append(results)
 
+    # end_round(self : BaseNegotiator)
+        # Resets the per-round state once the results of a round are in
+    def end_round(self):
+        self.past_iters = 0
+        if self.history_per_round:
+            for history in (self.their_past_offers, self.their_past_utilities, self.my_past_t_utility, self.my_past_offers, self.my_past_utilities, self.past_trends):
+                history.clear()
+
+    # get_utility(self : BaseNegotiator, offer : list(String)) --> Float
+        # The utility of offer to us. A move tends to score the same offer several times (for its history, to
+        # decide whether to accept, ...), so the utilities of the last utility_cache_size offers are kept, keyed
+        # by the offer as a tuple, until the preferences change. utility_cache_hits and utility_cache_misses
+        # count how often an offer was found there.
     def get_utility(self, offer):
         if offer is None:
             return 0
-        past_offer = self.offer[:] if self.offer is not None else None
-        self.offer = offer
-        util = self.utility()
-        self.offer = past_offer
+        key = tuple(offer)
+        cache = self.utility_cache
+        util = cache.get(key)
+        if util is not None:
+            self.utility_cache_hits += 1
+            cache.move_to_end(key)
+            return util
+        self.utility_cache_misses += 1
+        if len(self.position_weights) != len(self.preferences):
+            self.build_utility_table()
+        util = self.offer_utility(key)
+        cache[key] = util
+        if len(cache) > self.utility_cache_size:
+            cache.popitem(last=False)
         return util
\ No newline at end of file
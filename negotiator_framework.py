@@ -1,69 +1,128 @@
-from csv import DictReader
-from sys import argv, exit
+from sys import exit
+from argparse import ArgumentParser
 from itertools import islice
 from negotiator import Negotiator, BANegotiator
 from testers import LinearNegotiator, AsymptoticNegotiator, LinearThenAsymptoticNegotiator, FlexibleNegotiator, MeanNegotiator, PseudoRandomNegotiator
-from random import seed, randint
+from random import Random, seed, randint
+from hashlib import sha256
+from scenario import load_scenario
+from tracing import TRACE_LEVELS, TRACE_TURNS, PrintTrace, JsonlTrace
+from budget import MoveForfeited
 
-# read_scenario(parameterfile_name : String) --> (int, list(dict))
-    # Utility function to read in a single scenario from a csv file
-    # Expects a single int on the first line, specifying the iteration limit, 
-    # and then an arbitrary number of rows of three comma-separated columns, 
-    # specifying the name of each item, its rank (where 1 is best) for negotiator A,
-    # and the same for negotiator B
-def read_scenario(parameterfile_name):
-    # Open the file for reading
-    with open(parameterfile_name, 'r') as parameterfile:
-        # Consume the first line, getting the iteration limit
-        number_iterations = parameterfile.readline()
-        return (
-                int(number_iterations),
-                # Use Python's builtin CSV reader to read the rest of the file as specified
-                list(DictReader(parameterfile, fieldnames=["item_name", "negotiator_a", "negotiator_b"]))
-                )
+# match_rng(master_seed : Int, key : tuple) --> Random
+    # Random stream for a single match, derived from the master seed and the match's key (e.g. the negotiators, the
+    # scenario and the round). The same seed and key always give the same stream, whatever order matches run in.
+def match_rng(master_seed, *key):
+    digest = sha256(repr((master_seed,) + key).encode()).digest()
+    return Random(int.from_bytes(digest[:8], 'big'))
 
-# negotiate(num_iterations :  Int, negotiator_a : BaseNegotiator, negotiator_b : BaseNegotiator) --> (Boolean, list(String), Int)
+# seed_match(master_seed : Int, negotiator_a : BaseNegotiator, negotiator_b : BaseNegotiator, key : tuple) --> Random
+    # Gives each negotiator its own seeded stream for the match identified by key, and returns the stream negotiate()
+    # should use. The global random module is reseeded too, for negotiators that still draw from it. Returns None and
+    # leaves everything alone if master_seed is None.
+def seed_match(master_seed, negotiator_a, negotiator_b, *key):
+    if master_seed is None:
+        return None
+    rng = match_rng(master_seed, *key)
+    negotiator_a.rng = Random(rng.getrandbits(64))
+    negotiator_b.rng = Random(rng.getrandbits(64))
+    seed(rng.getrandbits(64))
+    return rng
+
+# negotiate(num_iterations :  Int, negotiator_a : BaseNegotiator, negotiator_b : BaseNegotiator, trace : Trace, rng : Random, instruments : Instrumentation, budget : TimeBudget) --> (Boolean, list(String), Int)
     # The main negotiation function, responsible for running a single scenario & coordinating interactions between the two
-    # negotiators.
-def negotiate(num_iterations, negotiator_a, negotiator_b):
-    # Get the initial offer from negotiator a - we pass in None to signify that no previous opposing offers have been made
-    (offer_a, offer_b) = (negotiator_a.make_offer(None), None)
+    # negotiators. If a trace wanting per-turn records is given, the offers on the table are sent to it every iteration.
+    # The reported utilities are scaled using rng (see seed_match), or the global random module if it is None. If
+    # instruments is given, both negotiators' moves are timed and their utility evaluations and shuffles counted. If a
+    # budget is given, moves that run over it are cut short and handled according to its policy. In a budgeted run a
+    # negotiator that raises an error forfeits the negotiation and is reset, and the error is recorded in the budget;
+    # otherwise the error is left to propagate.
+def negotiate(num_iterations, negotiator_a, negotiator_b, trace=None, rng=None, instruments=None, budget=None):
+    if instruments is not None:
+        with instruments.measure(negotiator_a, negotiator_b):
+            return negotiate(num_iterations, negotiator_a, negotiator_b, trace, rng, None, budget)
+
+    make_offer_a = negotiator_a.make_offer if budget is None else budget.bind('a', negotiator_a)
+    make_offer_b = negotiator_b.make_offer if budget is None else budget.bind('b', negotiator_b)
+    i = 0
+    # The negotiator whose code is running, to blame if it raises
+    mover = negotiator_a
+    try:
+        # Get the initial offer from negotiator a - we pass in None to signify that no previous opposing offers have been made
+        (offer_a, offer_b) = (make_offer_a(None), None)
+
+        # We scale the reported utility by a random factor
+        a_scale = rng.randint(1, 11) if rng is not None else randint(1, 11)
+        b_scale = rng.randint(1, 11) if rng is not None else randint(1, 11)
+        trace_turns = trace is not None and trace.wants_turns()
 
-    # We scale the reported utility by a random factor
-    a_scale = randint(1, 11)
-    b_scale = randint(1, 11)
+        # Keep trading offers until we reach an agreement or the iteration limit, whichever comes first
+        for i in range(num_iterations):
+            if trace_turns:
+                trace.turn(i, offer_a, offer_b)
 
-    # Keep trading offers until we reach an agreement or the iteration limit, whichever comes first
-    for i in range(num_iterations):
-        print(offer_a, offer_b)
-        
-        # Get from each negotiator the utility it received from the offer it most recently gave 
-        utility = (a_scale * negotiator_a.utility(), b_scale * negotiator_b.utility())
-        # Send b the latest offer from a and allow it to rebut
-        negotiator_b.receive_utility(utility[0])
-        offer_b = negotiator_b.make_offer(offer_a)
-        
-        # We signify agreement by both offers being structurally equal
-        if offer_a == offer_b:
-            return (True, offer_a, i)
+            # Get from a the utility it received from the offer it most recently gave
+            mover = negotiator_a
+            utility = a_scale * negotiator_a.utility()
+            # Send b the latest offer from a and allow it to rebut
+            mover = negotiator_b
+            negotiator_b.receive_utility(utility)
+            offer_b = make_offer_b(offer_a)
 
-        # If we didn't agree, let a respond to b's offer, recalculate utility and send 'a' the info
-        utility = (a_scale * negotiator_a.utility(), b_scale * negotiator_b.utility())
-        negotiator_a.receive_utility(utility[1])
-        offer_a = negotiator_a.make_offer(offer_b)
+            # We signify agreement by both offers being structurally equal
+            if offer_a == offer_b:
+                return (True, offer_a, i)
 
-        if offer_a == offer_b:
-            return (True, offer_a, i)
+            # If we didn't agree, let a respond to b's offer, recalculate utility and send 'a' the info
+            utility = b_scale * negotiator_b.utility()
+            mover = negotiator_a
+            negotiator_a.receive_utility(utility)
+            offer_a = make_offer_a(offer_b)
 
+            if offer_a == offer_b:
+                return (True, offer_a, i)
+    except MoveForfeited:
+        # A negotiator ran out of time and forfeited, so the negotiation fails where it stands
+        return (False, None, i)
+    except Exception as error:
+        # Outside a budgeted run an error is most likely a bug, so it surfaces
+        if budget is None:
+            raise
+        # A negotiator raised an error: it forfeits, and starts over from a clean state
+        budget.failed('a' if mover is negotiator_a else 'b', mover, error)
+        if trace is not None:
+            trace.summary("{} failed: {}: {}".format(mover.__class__.__name__, error.__class__.__name__, error))
+        mover.reset()
+        return (False, None, i)
 
     # If we failed overall, then there's no ordering to return
     return (False, None, num_iterations)
 
+# add_trace_arguments(parser : ArgumentParser, default : String)
+    # Adds the --trace and --trace-file options shared by the framework and the driver
+def add_trace_arguments(parser, default):
+    parser.add_argument("--trace", choices=sorted(TRACE_LEVELS), default=default, help="off: final results only, summary: also each round, turns: also every offer exchanged")
+    parser.add_argument("--trace-file", help="write per-turn records to this file as JSON lines instead of printing them")
+
+# make_trace(args : Namespace) --> Trace
+    # Builds the trace selected by add_trace_arguments' options
+def make_trace(args):
+    level = TRACE_LEVELS[args.trace]
+    if args.trace_file is not None and level >= TRACE_TURNS:
+        return JsonlTrace(open(args.trace_file, 'w'), level=level)
+    return PrintTrace(level)
+
 if __name__ == "__main__":
+    parser = ArgumentParser(description="Runs two negotiators against each other on each scenario")
+    add_trace_arguments(parser, "turns")
+    parser.add_argument("--seed", type=int, help="master seed making the run reproducible")
+    parser.add_argument("scenarios", nargs="*", help="scenario files, in csv format")
+    args = parser.parse_args()
     # We can't run without at least one scenario. We can, however, run with multiple provided scenarios
-    if len(argv) < 2:
+    if len(args.scenarios) < 1:
         print("Please provide at least one scenario file, in csv format.")
         exit(-42)
+    trace = make_trace(args)
     score_a = score_b = 0
     # We will replace Negotiator here with <your id>_Negotiator, as specified in the Readme
     negotiator_a = AsymptoticNegotiator()
@@ -74,29 +133,27 @@ if __name__ == "__main__":
     # negotiator_b = FlexibleNegotiator()
     # negotiator_b = MeanNegotiator()
     # negotiator_b = PseudoRandomNegotiator()
-    for scenario in argv[1:]:
-        # Get the scenario parameters
-        (num_iters, mapping) = read_scenario(scenario)
-        # Separate the mapping out for each negotiator, and sort the items from it into a list
-        # based upon the preferences of each negotiator
-        a_mapping = {item["item_name"] : int(item["negotiator_a"]) for item in mapping}
-        a_order = sorted(a_mapping, key=a_mapping.get, reverse=True)
-        b_mapping = {item["item_name"] : int(item["negotiator_b"]) for item in mapping}
-        b_order = sorted(b_mapping, key=b_mapping.get, reverse=True)
+    for scenario in args.scenarios:
+        trace.start_match(scenario)
+        # Get the scenario parameters, with each negotiator's preferred item ordering
+        scenario_params = load_scenario(scenario)
+        num_iters = scenario_params.iter_limit
         # Give each negotiator their preferred item ordering
-        negotiator_a.initialize(a_order, num_iters)
-        negotiator_b.initialize(b_order, num_iters)
+        negotiator_a.initialize(scenario_params.a_preferences(), num_iters)
+        negotiator_b.initialize(scenario_params.b_preferences(), num_iters)
         for i in range(10):
             # Get the result of the negotiation
-            (result, order, count) = negotiate(num_iters, negotiator_a, negotiator_b)
+            rng = seed_match(args.seed, negotiator_a, negotiator_b, negotiator_a.__class__.__name__, negotiator_b.__class__.__name__, scenario, i)
+            (result, order, count) = negotiate(num_iters, negotiator_a, negotiator_b, trace, rng)
             # Assign points to each negotiator. Note that if the negotiation failed, each negotiatior receives a negative penalty
             # However, it is also possible in a "successful" negotiation for a given negotiator to receive negative points
-            (points_a, points_b) = (negotiator_a.utility(), negotiator_b.utility()) if result else (-len(a_order), -len(b_order))
+            (points_a, points_b) = (negotiator_a.utility(), negotiator_b.utility()) if result else (-len(scenario_params), -len(scenario_params))
             results = (result, points_a, points_b, count)
             score_a += points_a
             score_b += points_b
             # Update each negotiator with the final result, points assigned, and number of iterations taken to reach an agreement
             negotiator_a.receive_results(results)
             negotiator_b.receive_results(results)
-            print("{} negotiation:\n\tNegotiator A: {}\n\tNegotiator B: {}".format("Successful" if result else "Failed", points_a, points_b))
+            trace.summary("{} negotiation:\n\tNegotiator A: {}\n\tNegotiator B: {}".format("Successful" if result else "Failed", points_a, points_b))
+    trace.close()
     print("Final result:\n\tNegotiator A: {}\n\tNegotiator B: {}".format(score_a, score_b))
@@ -0,0 +1,132 @@
+from math import exp
+
+# Utility is a sum of per-(item, position) terms, weight[pos] - |pos - rank|, so a small change to an offer only
+# changes a few of them: swapping two items changes two terms, and moving one item shifts only the items between its
+# old and new position. An IncrementalOffer keeps an offer together with its utility and updates that utility as the
+# offer is changed, in O(1) per swap and O(distance) per move, which makes it cheap to try thousands of local
+# changes per turn (see climb).
+
+class IncrementalOffer:
+    # ranks maps every item to its rank in the preference ordering the offer is scored against, and weights are the
+    # position weights (see BaseNegotiator.build_utility_table). utility can be given if it is already known.
+    def __init__(self, offer, ranks, weights, utility=None):
+        self.items = list(offer)
+        self.weights = weights
+        # Rank of the item at each position
+        self.ranks = [ranks[item] for item in self.items]
+        self.utility = utility if utility is not None else self.rescore()
+
+    def __len__(self):
+        return len(self.items)
+
+    # offer(self : IncrementalOffer) --> list(String)
+        # A copy of the offer as it stands
+    def offer(self):
+        return self.items[:]
+
+    # rescore(self : IncrementalOffer) --> Float
+        # Recomputes the utility from scratch, in position order like BaseNegotiator.utility(), dropping any rounding
+        # error the incremental updates have built up
+    def rescore(self):
+        weights = self.weights
+        points = 0
+        for pos, rank in enumerate(self.ranks):
+            points += weights[pos] - abs(pos - rank)
+        self.utility = points
+        return points
+
+    # delta_if_swap(self : IncrementalOffer, i : Int, j : Int) --> Float
+        # Change in utility if the items at positions i and j were swapped
+    def delta_if_swap(self, i, j):
+        ranks = self.ranks
+        # The position weights stay put, so only the distance terms change
+        return abs(i - ranks[i]) + abs(j - ranks[j]) - abs(i - ranks[j]) - abs(j - ranks[i])
+
+    # swap(self : IncrementalOffer, i : Int, j : Int) --> Float
+        # Swaps the items at positions i and j, returning the new utility
+    def swap(self, i, j):
+        self.utility += self.delta_if_swap(i, j)
+        (self.items[i], self.items[j]) = (self.items[j], self.items[i])
+        (self.ranks[i], self.ranks[j]) = (self.ranks[j], self.ranks[i])
+        return self.utility
+
+    # delta_if_move(self : IncrementalOffer, i : Int, j : Int) --> Float
+        # Change in utility if the item at position i were taken out and put back in at position j, shifting the
+        # items in between by one
+    def delta_if_move(self, i, j):
+        ranks = self.ranks
+        step = 1 if i < j else -1
+        # The items in between shift one position towards i
+        delta = sum(abs(pos - ranks[pos]) - abs(pos - step - ranks[pos]) for pos in range(i + step, j + step, step))
+        return delta + abs(i - ranks[i]) - abs(j - ranks[i])
+
+    # move(self : IncrementalOffer, i : Int, j : Int) --> Float
+        # Moves the item at position i to position j, shifting the items in between by one, and returns the new
+        # utility
+    def move(self, i, j):
+        self.utility += self.delta_if_move(i, j)
+        self.items.insert(j, self.items.pop(i))
+        self.ranks.insert(j, self.ranks.pop(i))
+        return self.utility
+
+    # wander(self : IncrementalOffer, rng : Random, steps : Int, floor : Float) --> Float
+        # Random walk of up to steps random swaps, making each one that keeps the utility above floor. Started from
+        # a good offer (e.g. our preferences), it gives a varied offer that is still acceptable to us. Returns the
+        # utility reached.
+    def wander(self, rng, steps, floor):
+        n = len(self.items)
+        if n < 2:
+            return self.utility
+        for step in range(steps):
+            i = rng.randrange(n)
+            j = rng.randrange(n - 1)
+            j += j >= i
+            delta = self.delta_if_swap(i, j)
+            if self.utility + delta > floor:
+                self.swap(i, j)
+        return self.utility
+
+    # climb(self : IncrementalOffer, rng : Random, steps : Int, goal : Float, temperature : Float, cooling : Float) --> Float
+        # Local search over random swaps for up to steps steps, stopping early once the utility reaches goal. A swap
+        # that raises the utility is always made; with a temperature, one that lowers it by d is made with
+        # probability exp(-d / temperature) (simulated annealing), the temperature being multiplied by cooling after
+        # every step. Returns the utility reached.
+    def climb(self, rng, steps, goal=None, temperature=0, cooling=1):
+        n = len(self.items)
+        if n < 2:
+            return self.utility
+        for step in range(steps):
+            if goal is not None and self.utility >= goal:
+                break
+            i = rng.randrange(n)
+            j = rng.randrange(n - 1)
+            # Never pick i twice, so every proposal is a real swap
+            j += j >= i
+            delta = self.delta_if_swap(i, j)
+            if delta > 0 or (temperature > 0 and rng.random() < exp(delta / temperature)):
+                self.swap(i, j)
+            temperature *= cooling
+        return self.utility
+
+# narrow_gap(mine : IncrementalOffer, theirs : IncrementalOffer, rng : Random, steps : Int) --> (Float, Float)
+    # Random walk of up to steps random swaps over one offer held as two IncrementalOffers, mine scored against our
+    # preferences and theirs against (an estimate of) theirs. A swap is made if it leaves mine + theirs as it is and
+    # narrows mine - theirs while keeping it positive; both are swapped together, so they always hold the same
+    # offer. Started from an offer that maximizes mine + theirs, such as our preferences, it finds a more even split
+    # of that maximum. Returns the two utilities reached.
+def narrow_gap(mine, theirs, rng, steps):
+    n = len(mine)
+    if n < 2:
+        return (mine.utility, theirs.utility)
+    # Both are scored with the same position weights, so the gap is a whole number; rounding drops the float error
+    gap = round(mine.utility - theirs.utility)
+    for step in range(steps):
+        i = rng.randrange(n)
+        j = rng.randrange(n - 1)
+        j += j >= i
+        delta = mine.delta_if_swap(i, j)
+        if delta < 0 and delta + theirs.delta_if_swap(i, j) == 0 and gap + 2 * delta > 0:
+            mine.swap(i, j)
+            theirs.swap(i, j)
+            gap += 2 * delta
+    return (mine.utility, theirs.utility)
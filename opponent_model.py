@@ -0,0 +1,95 @@
+from collections import deque
+
+# Estimate of the opponent's preference ordering from the offers they make and the utilities they report for them.
+# Every offer is a ranking of the items, so the estimate is a weighted Borda count: an item at position pos of an
+# n-item offer earns n - pos points, weighted by the utility they reported for that offer, so the offers they value
+# most count most. Folding in an offer is O(n); the estimated ranks and the score table built from them are only
+# recomputed when they are asked for after the estimate has changed.
+
+class OpponentModel:
+    # Items are identified by our own ids (see BaseNegotiator.encode_offer), and weights are the position weights
+    # offers are scored with (see BaseNegotiator.build_utility_table). With a window, only the most recent window
+    # offers are counted.
+    def __init__(self, weights, window=None):
+        self.weights = weights
+        self.window = window
+        self.clear()
+
+    # clear(self : OpponentModel)
+        # Forgets every offer seen
+    def clear(self):
+        n = len(self.weights)
+        # Utility-weighted Borda points of each item, and unweighted ones for when every reported utility is
+        # negative (or zero)
+        self.points = [0.0] * n
+        self.plain_points = [0] * n
+        self.total_weight = 0.0
+        self.count = 0
+        # (ids, weight) of the offers counted, to take them out again once they leave the window
+        self.counted = deque()
+        self.estimate = None
+        self.table = None
+
+    def __len__(self):
+        return self.count
+
+    # observe(self : OpponentModel, ids : list(Int), utility : Float)
+        # Counts an offer of theirs, as a list of item ids, together with the utility they reported for it
+    def observe(self, ids, utility):
+        weight = max(utility, 0)
+        self.add(ids, weight, 1)
+        if self.window is not None:
+            self.counted.append((ids, weight))
+            if len(self.counted) > self.window:
+                (old_ids, old_weight) = self.counted.popleft()
+                self.add(old_ids, old_weight, -1)
+        self.estimate = None
+        self.table = None
+
+    def add(self, ids, weight, sign):
+        n = len(ids)
+        points = self.points
+        plain_points = self.plain_points
+        for pos, item in enumerate(ids):
+            points[item] += sign * weight * (n - pos)
+            plain_points[item] += sign * (n - pos)
+        self.total_weight += sign * weight
+        self.count += sign
+
+    # ranks(self : OpponentModel) --> list(Int)
+        # Estimated rank of each item id in their preferences, or None before any offer has been seen
+    def ranks(self):
+        if self.count == 0:
+            return None
+        if self.estimate is None:
+            points = self.points if self.total_weight > 0 else self.plain_points
+            # Highest points first; ties go to the item we rank higher, so the estimate is deterministic
+            ordering = sorted(range(len(points)), key=lambda item: -points[item])
+            self.estimate = [0] * len(ordering)
+            for rank, item in enumerate(ordering):
+                self.estimate[item] = rank
+        return self.estimate
+
+    # score_table(self : OpponentModel) --> list(list(Float))
+        # Their estimated item x position score table, where score_table[id][pos] is the points they get for item id
+        # at position pos (see BaseNegotiator.build_score_table). None before any offer has been seen.
+    def score_table(self):
+        ranks = self.ranks()
+        if ranks is None:
+            return None
+        if self.table is None:
+            weights = self.weights
+            self.table = [[weight - abs(pos - rank) for pos, weight in enumerate(weights)] for rank in ranks]
+        return self.table
+
+    # expected_utility(self : OpponentModel, ids : list(Int)) --> Float
+        # Their estimated utility for an offer given as a list of item ids, or 0 before any offer has been seen
+    def expected_utility(self, ids):
+        ranks = self.ranks()
+        if ranks is None:
+            return 0
+        weights = self.weights
+        points = 0
+        for pos, item in enumerate(ids):
+            points += weights[pos] - abs(pos - ranks[item])
+        return points
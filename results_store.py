@@ -0,0 +1,138 @@
+import sqlite3
+from datetime import datetime, timezone
+
+# Results of tournament runs in a SQLite database. Every match (one work unit: two negotiators, one scenario) is
+# streamed in as it completes, along with each of its rounds' (result, points_a, points_b, count). Writes are
+# buffered and committed in batches, and the reports - per-scenario summaries, standings - are indexed queries, so
+# neither the run nor a later report has to hold every result in memory. A file database outlives the run and can be
+# queried again later; ":memory:" keeps everything in memory for the length of the run.
+#
+# A match is written in the same transaction as its rounds, so a run that is interrupted leaves only whole matches
+# behind, and it can be resumed (see resumable_run and completed) by playing just the matches it is missing. Each
+# match records its unit, its position in the run's schedule, so a resumed run reports in the same order as one
+# that was never interrupted.
+
+# Scores and points are left untyped so they come back exactly as they were recorded, ints as ints
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    seed INTEGER,
+    description TEXT
+);
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    run INTEGER NOT NULL REFERENCES runs(id),
+    unit INTEGER NOT NULL,
+    negotiator_a TEXT NOT NULL,
+    negotiator_b TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    score_a NOT NULL,
+    score_b NOT NULL,
+    wins_a INTEGER NOT NULL,
+    wins_b INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    match INTEGER NOT NULL REFERENCES matches(id),
+    round INTEGER NOT NULL,
+    result INTEGER NOT NULL,
+    points_a NOT NULL,
+    points_b NOT NULL,
+    iterations INTEGER NOT NULL,
+    PRIMARY KEY (match, round)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX IF NOT EXISTS matches_by_unit ON matches (run, unit);
+CREATE INDEX IF NOT EXISTS matches_by_a ON matches (run, negotiator_a);
+CREATE INDEX IF NOT EXISTS matches_by_b ON matches (run, negotiator_b);
+CREATE INDEX IF NOT EXISTS matches_by_scenario ON matches (run, scenario);
+"""
+
+# Each match's score, from the point of view of each of the two negotiators in it
+SIDES = """
+SELECT negotiator_a AS name, score_a AS mine, score_b AS theirs FROM matches WHERE run = :run
+UNION ALL
+SELECT negotiator_b AS name, score_b AS mine, score_a AS theirs FROM matches WHERE run = :run
+"""
+
+class ResultsStore:
+    # batch_size is the number of rows written between commits; with 1 every match is committed as it is recorded
+    def __init__(self, path=":memory:", batch_size=1000):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.batch_size = batch_size
+        self.pending_matches = []
+        self.pending_rounds = []
+        # Match ids are handed out here, so rounds can be buffered along with their match
+        self.next_match = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM matches").fetchone()[0]
+
+    # start_run(self : ResultsStore, seed : Int, description : String) --> Int
+        # Registers a new run and returns its id
+    def start_run(self, seed=None, description=None):
+        cursor = self.connection.execute("INSERT INTO runs (started, seed, description) VALUES (?, ?, ?)", (datetime.now(timezone.utc).isoformat(), seed, description))
+        self.connection.commit()
+        return cursor.lastrowid
+
+    # resumable_run(self : ResultsStore, description : String) --> (Int, Int)
+        # The (id, seed) of the latest run with description, or None if there is none
+    def resumable_run(self, description):
+        return self.connection.execute("SELECT id, seed FROM runs WHERE description = ? ORDER BY id DESC LIMIT 1", (description,)).fetchone()
+
+    # completed(self : ResultsStore, run : Int) --> set((String, String, String))
+        # The (negotiator_a, negotiator_b, scenario) of every match recorded for run
+    def completed(self, run):
+        self.flush()
+        return set(self.connection.execute("SELECT negotiator_a, negotiator_b, scenario FROM matches WHERE run = ?", (run,)))
+
+    # record_match(self : ResultsStore, run : Int, unit : Int, negotiator_a : String, negotiator_b : String, scenario : String, scenario_summary : dict)
+        # Adds a match, unit being its position in the run's schedule, given the summary run_scenario returned for it
+        # (see driver.py)
+    def record_match(self, run, unit, negotiator_a, negotiator_b, scenario, scenario_summary):
+        match = self.next_match
+        self.next_match += 1
+        self.pending_matches.append((match, run, unit, negotiator_a, negotiator_b, scenario, scenario_summary['a']['score'], scenario_summary['b']['score'], scenario_summary['a']['wins'], scenario_summary['b']['wins']))
+        self.pending_rounds.extend((match, i, result, points_a, points_b, count) for (i, (result, points_a, points_b, count)) in enumerate(scenario_summary['rounds']))
+        if len(self.pending_matches) + len(self.pending_rounds) >= self.batch_size:
+            self.flush()
+
+    # flush(self : ResultsStore)
+        # Writes and commits everything buffered
+    def flush(self):
+        with self.connection:
+            self.connection.executemany("INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self.pending_matches)
+            self.connection.executemany("INSERT INTO rounds VALUES (?, ?, ?, ?, ?, ?)", self.pending_rounds)
+        self.pending_matches = []
+        self.pending_rounds = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    # matches(self : ResultsStore, run : Int) --> iterator((String, String, String, Float, Float, Int, Int))
+        # Every match of run as (negotiator_a, negotiator_b, scenario, score_a, score_b, wins_a, wins_b), in schedule
+        # order
+    def matches(self, run):
+        self.flush()
+        return self.connection.execute("SELECT negotiator_a, negotiator_b, scenario, score_a, score_b, wins_a, wins_b FROM matches WHERE run = ? ORDER BY unit", (run,))
+
+    # standings(self : ResultsStore, run : Int) --> list((String, Float, Int, Int, Int, Int))
+        # Each negotiator's (name, points, matches, won, drawn, lost) over the matches of run, on either side,
+        # ranked by points and then matches won
+    def standings(self, run):
+        self.flush()
+        return self.connection.execute("""
+            SELECT name, SUM(mine) AS points, COUNT(*), SUM(mine > theirs) AS won, SUM(mine = theirs), SUM(mine < theirs)
+            FROM ({}) GROUP BY name ORDER BY points DESC, won DESC, name
+            """.format(SIDES), {"run": run}).fetchall()
+
+    # scenario_totals(self : ResultsStore, run : Int) --> list((String, Int, Float, Float, Float, Float))
+        # Per scenario of run: (scenario, matches, points A scored, points B scored, share of rounds that reached
+        # agreement, mean iterations per round)
+    def scenario_totals(self, run):
+        self.flush()
+        return self.connection.execute("""
+            SELECT matches.scenario, COUNT(DISTINCT matches.id), SUM(rounds.points_a), SUM(rounds.points_b), AVG(rounds.result), AVG(rounds.iterations)
+            FROM matches JOIN rounds ON rounds.match = matches.id
+            WHERE matches.run = ? GROUP BY matches.scenario ORDER BY matches.scenario
+            """, (run,)).fetchall()
@@ -0,0 +1,80 @@
+from collections import deque
+
+# Least-squares trend of a stream of values against their index (0, 1, 2, ...), maintained incrementally.
+# add() folds in one value in O(1) using Welford-style running means and co-moments, so slope, intercept
+# and R^2 are available at any point without rescanning the stream. With a window, only the most recent
+# window values are kept in the fit; older values are removed as new ones arrive, also in O(1).
+class RunningRegression:
+    def __init__(self, window=None):
+        self.window = window
+        self.values = deque()
+        self.count = 0
+        # Index the next value will get
+        self.next_x = 0
+        self.mean_x = 0
+        self.mean_y = 0
+        # Sums of squared deviations from the mean for x and y, and the co-moment of x and y
+        self.m2_x = 0
+        self.m2_y = 0
+        self.c_xy = 0
+
+    def __len__(self):
+        return self.count
+
+    # add(self : RunningRegression, y : Float)
+        # Adds the next value of the stream, dropping the oldest one if the window is full
+    def add(self, y):
+        x = self.next_x
+        self.next_x += 1
+        self.count += 1
+        dx = x - self.mean_x
+        self.mean_x += dx / self.count
+        dy = y - self.mean_y
+        self.mean_y += dy / self.count
+        self.m2_x += dx * (x - self.mean_x)
+        self.m2_y += dy * (y - self.mean_y)
+        self.c_xy += dx * (y - self.mean_y)
+        if self.window is not None:
+            self.values.append(y)
+            if self.count > self.window:
+                self.remove_oldest()
+        elif self.count == 1:
+            self.values.append(y)
+
+    # remove_oldest(self : RunningRegression)
+        # Takes the oldest value in the window back out of the fit
+    def remove_oldest(self):
+        y = self.values.popleft()
+        x = self.next_x - self.count
+        self.count -= 1
+        if self.count == 0:
+            self.mean_x = self.mean_y = self.m2_x = self.m2_y = self.c_xy = 0
+            return
+        dx = x - self.mean_x
+        self.mean_x -= dx / self.count
+        dy = y - self.mean_y
+        self.mean_y -= dy / self.count
+        self.m2_x -= dx * (x - self.mean_x)
+        self.m2_y -= dy * (y - self.mean_y)
+        self.c_xy -= dx * (y - self.mean_y)
+
+    # first(self : RunningRegression) --> Float
+        # The oldest value still in the fit (the first value ever added, without a window)
+    def first(self):
+        return self.values[0] if self.values else 0
+
+    # slope(self : RunningRegression) --> Float
+    def slope(self):
+        return self.c_xy / self.m2_x if self.m2_x > 0 else 0
+
+    # intercept(self : RunningRegression) --> Float
+        # Fitted value at index 0
+    def intercept(self):
+        return self.mean_y - self.slope() * self.mean_x
+
+    # r_squared(self : RunningRegression) --> Float
+        # Coefficient of determination of the fit; 0 when either x or y has no variance
+    def r_squared(self):
+        if self.m2_x <= 0 or self.m2_y <= 0:
+            return 0
+        return (self.c_xy * self.c_xy) / (self.m2_x * self.m2_y)
@@ -0,0 +1,354 @@
+import os
+from json import dumps, loads
+from math import ceil
+from random import Random
+from select import select
+from struct import Struct
+from subprocess import Popen, PIPE
+from sys import executable, stdin, stdout
+from threading import get_ident
+from time import monotonic
+from budget import MoveForfeited
+from agent_runtime import handle_request, load_negotiator_class
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Runs untrusted submissions (e.g. <student id>.Negotiator) out of process. Each submission is loaded once into a
+# long-lived worker subprocess, which plays one negotiator session after another, so a match costs a few pipe round
+# trips rather than an interpreter start. Workers run under CPU and address-space limits, and a worker that crashes,
+# runs out of time or hangs is killed and restarted; the negotiation it was in is forfeited. This isolates the run
+# from a submission's crashes and runaway loops - it is not a security sandbox, since a worker can still touch the
+# filesystem and network like any other process.
+#
+# The framework and a worker exchange frames over the worker's stdin and stdout: a 4-byte little-endian length
+# followed by that many bytes of JSON. The requests are those of the agent protocol (see agent_runtime.py), plus
+# "new", which starts a fresh negotiator session, "set_rng", which installs a Random state, and "cpu", which reports
+# the CPU seconds the worker has used. Anything the submission prints goes to the worker's stderr instead of the
+# protocol stream.
+
+FRAME_HEADER = Struct('<I')
+
+# Raised when a worker fails a call: by raising, crashing, or running out of time. A failure during a negotiation
+# forfeits it (see negotiate()).
+class WorkerFailed(MoveForfeited):
+    pass
+
+# Resource limits for a worker: CPU seconds per call, address space in megabytes, and how long to wait for any one
+# call before treating the worker as hung. CPU time is also capped over the worker's life. So that the cap doesn't
+# land in the middle of a healthy worker's match, a worker that has used cpu_recycle seconds (half its lifetime by
+# default) is replaced before its next session starts; one that still reaches the cap dies and is replaced like any
+# other.
+class WorkerLimits:
+    def __init__(self, cpu_per_call=10, memory_mb=1024, call_timeout=30, cpu_lifetime=3600, cpu_recycle=None):
+        self.cpu_per_call = cpu_per_call
+        self.memory_mb = memory_mb
+        self.call_timeout = call_timeout
+        self.cpu_lifetime = cpu_lifetime
+        self.cpu_recycle = cpu_recycle if cpu_recycle is not None else cpu_lifetime / 2
+
+    # apply(self : WorkerLimits)
+        # Called in the worker before it loads the submission
+    def apply(self):
+        if resource is None:
+            return
+        memory = self.memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        resource.setrlimit(resource.RLIMIT_CPU, (self.cpu_lifetime, self.cpu_lifetime))
+
+    # arguments(self : WorkerLimits) --> list(String)
+        # Command line options passing the limits to a worker
+    def arguments(self):
+        return ["--cpu-per-call", str(self.cpu_per_call), "--memory-mb", str(self.memory_mb), "--cpu-lifetime", str(self.cpu_lifetime)]
+
+# One worker subprocess serving the submission spec (module.Class)
+class Worker:
+    def __init__(self, spec, limits):
+        self.spec = spec
+        self.limits = limits
+        self.process = None
+        # Class name reported by the worker once it has loaded the submission
+        self.name = None
+        # Number of negotiator sessions started in the worker, across restarts; identifies the current one
+        self.session = 0
+
+    # start(self : Worker)
+        # Launches the worker and waits for it to load the submission
+    def start(self):
+        self.process = Popen([executable, os.path.abspath(__file__), self.spec] + self.limits.arguments(), stdin=PIPE, stdout=PIPE, cwd=os.getcwd())
+        try:
+            greeting = self.receive()
+        except WorkerFailed:
+            self.stop()
+            raise
+        if "error" in greeting:
+            self.stop()
+            raise WorkerFailed("{} failed to load: {}".format(self.spec, greeting["error"]))
+        self.name = greeting["agent"]
+
+    # stop(self : Worker)
+        # Kills the worker, if it is running
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process.stdin.close()
+            self.process.stdout.close()
+            self.process = None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    # new_session(self : Worker) --> Int
+        # Starts a fresh negotiator in the worker, returning its session number. A worker that has used up
+        # cpu_recycle seconds of CPU time is restarted first, between sessions rather than when it hits its lifetime
+        # cap part way through one.
+    def new_session(self):
+        if self.alive() and self.call("cpu") >= self.limits.cpu_recycle:
+            self.stop()
+        self.call("new")
+        self.session += 1
+        return self.session
+
+    # call(self : Worker, name : String, args : tuple) --> value
+        # Makes one request, (re)starting the worker first if needed. A worker that dies or doesn't answer in time is
+        # stopped, to be restarted by the next call; either way, and on an error reply, WorkerFailed is raised. A call
+        # interrupted by anything else also stops the worker.
+    def call(self, name, *args):
+        if not self.alive():
+            self.stop()
+            self.start()
+            # Whatever session was running died with the process
+            self.session += 1
+        try:
+            self.send({"call": name, "args": args})
+            reply = self.receive()
+        except BaseException:
+            # Whatever stopped us - the worker failing, or a time budget interrupting the call - its reply may still
+            # be on its way, so the worker can't be talked to any more
+            self.stop()
+            raise
+        if "error" in reply:
+            raise WorkerFailed("{}: {}".format(self.spec, reply["error"]))
+        return reply["result"]
+
+    def send(self, message):
+        data = dumps(message).encode()
+        try:
+            self.process.stdin.write(FRAME_HEADER.pack(len(data)) + data)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise WorkerFailed("{} exited (status {})".format(self.spec, self.process.poll()))
+
+    def receive(self):
+        deadline = monotonic() + self.limits.call_timeout
+        (length,) = FRAME_HEADER.unpack(self.read_exactly(FRAME_HEADER.size, deadline))
+        return loads(self.read_exactly(length, deadline))
+
+    # read_exactly(self : Worker, size : Int, deadline : Float) --> bytes
+        # Reads size bytes from the worker, failing if it exits or deadline (on the monotonic clock) passes first
+    def read_exactly(self, size, deadline):
+        fd = self.process.stdout.fileno()
+        data = b""
+        while len(data) < size:
+            remaining = deadline - monotonic()
+            if remaining <= 0 or not select([fd], [], [], remaining)[0]:
+                raise WorkerFailed("{} took longer than {}s".format(self.spec, self.limits.call_timeout))
+            chunk = os.read(fd, size - len(data))
+            if not chunk:
+                raise WorkerFailed("{} exited (status {})".format(self.spec, self.process.wait()))
+            data += chunk
+        return data
+
+# The workers of a run, one per submission, started on first use and kept until close()
+class WorkerPool:
+    def __init__(self, limits=None):
+        self.limits = limits if limits is not None else WorkerLimits()
+        self.workers = {}
+
+    # worker(self : WorkerPool, spec : String) --> Worker
+    def worker(self, spec):
+        if spec not in self.workers:
+            self.workers[spec] = Worker(spec, self.limits)
+        return self.workers[spec]
+
+    # negotiator(self : WorkerPool, spec : String) --> SandboxedNegotiator
+        # A fresh negotiator of the submission spec, replacing the worker's previous session
+    def negotiator(self, spec):
+        return SandboxedNegotiator(self, self.worker(spec))
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.stop()
+
+# A negotiator session in a worker, usable wherever a BaseNegotiator is. Calls that happen during a negotiation
+# (make_offer, utility, receive_utility) raise WorkerFailed when the worker fails, forfeiting the negotiation; the
+# others only record the failure. If the session was lost - the worker restarted, or another session was started in
+# it - a new one is initialized with the same preferences, so later rounds can still be played, without the
+# negotiator's memory of the earlier ones.
+class SandboxedNegotiator:
+    def __init__(self, pool, worker):
+        self.pool = pool
+        self.worker = worker
+        self.offer = []
+        self.preferences = []
+        self.iter_limit = 0
+        # Our session number in the worker (see Worker.new_session)
+        self.session = None
+        # What went wrong each time the worker failed us
+        self.failures = []
+        # Arguments for BaseNegotiator.set_history_limits, passed on to every session
+        self.history_limits = (None, False)
+
+    # call(self : SandboxedNegotiator, name : String, args : tuple) --> value
+    def call(self, name, *args):
+        try:
+            if self.session != self.worker.session or not self.worker.alive():
+                self.start_session()
+            return self.worker.call(name, *args)
+        except WorkerFailed as failure:
+            self.failures.append(str(failure))
+            raise
+
+    # start_session(self : SandboxedNegotiator)
+        # Starts this negotiator in the worker, initialized with our preferences if we have them
+    def start_session(self):
+        self.session = None
+        session = self.worker.new_session()
+        if self.history_limits != (None, False):
+            self.worker.call("set_history_limits", *self.history_limits)
+        if self.preferences:
+            self.worker.call("initialize", self.preferences, self.iter_limit)
+        self.session = session
+
+    # quietly(self : SandboxedNegotiator, name : String, args : tuple)
+        # Makes a call whose failure should not interrupt the framework
+    def quietly(self, name, *args):
+        try:
+            self.call(name, *args)
+        except WorkerFailed:
+            pass
+
+    def initialize(self, preferences, iter_limit):
+        self.preferences = list(preferences)
+        self.iter_limit = iter_limit
+        self.offer = []
+        try:
+            self.start_session()
+        except WorkerFailed as failure:
+            self.failures.append(str(failure))
+
+    def set_history_limits(self, window=None, per_round=False):
+        self.history_limits = (window, per_round)
+
+    # reset(self : SandboxedNegotiator)
+        # Drops the session, so the next call starts a fresh one (see BaseNegotiator.reset)
+    def reset(self):
+        self.session = None
+        self.offer = []
+
+    def make_offer(self, offer):
+        self.offer = self.call("make_offer", offer)
+        return self.offer
+
+    def utility(self):
+        return self.call("utility")
+
+    def receive_utility(self, utility):
+        self.call("receive_utility", utility)
+
+    def receive_results(self, results):
+        self.quietly("receive_results", results)
+
+    # The framework seeds negotiators by assigning rng (see seed_match); the state is copied into the worker
+    @property
+    def rng(self):
+        return None
+
+    @rng.setter
+    def rng(self, value):
+        self.quietly("set_rng", value.getstate())
+
+# A submission run in a worker, usable in place of a negotiator class (e.g. in driver.py's list of negotiators):
+# calling it gives a fresh SandboxedNegotiator from this process's pool for its limits
+class Submission:
+    def __init__(self, spec, limits=None):
+        self.spec = spec
+        self.limits = limits if limits is not None else WorkerLimits()
+        self.__name__ = spec
+
+    def __call__(self):
+        return shared_pool(self.limits).negotiator(self.spec)
+
+# The pools of this process, by thread and limits, so every match a thread plays reuses the same workers (and no two
+# threads talk to one worker at once)
+shared_pools = {}
+
+# shared_pool(limits : WorkerLimits) --> WorkerPool
+def shared_pool(limits):
+    key = (get_ident(), limits.cpu_per_call, limits.memory_mb, limits.call_timeout, limits.cpu_lifetime, limits.cpu_recycle)
+    if key not in shared_pools:
+        shared_pools[key] = WorkerPool(limits)
+    return shared_pools[key]
+
+# run_worker(spec : String, limits : WorkerLimits)
+    # The worker's side: loads the submission and serves requests from stdin until it is closed
+def run_worker(spec, limits):
+    requests = stdin.buffer
+    # Keep the protocol stream to ourselves, sending anything the submission prints to stderr
+    replies = os.fdopen(os.dup(stdout.fileno()), 'wb')
+    os.dup2(2, stdout.fileno())
+
+    def send(message):
+        data = dumps(message).encode()
+        replies.write(FRAME_HEADER.pack(len(data)) + data)
+        replies.flush()
+
+    limits.apply()
+    try:
+        negotiator_class = load_negotiator_class(spec)
+    except Exception as error:
+        send({"error": "{}: {}".format(error.__class__.__name__, error)})
+        return
+    send({"agent": negotiator_class.__name__})
+    negotiator = None
+    while True:
+        header = requests.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return
+        request = loads(requests.read(FRAME_HEADER.unpack(header)[0]))
+        # Each call gets cpu_per_call more seconds of CPU time than the worker has used so far
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            soft = min(limits.cpu_lifetime, ceil(usage.ru_utime + usage.ru_stime) + limits.cpu_per_call)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, limits.cpu_lifetime))
+        if request["call"] == "cpu":
+            usage = resource.getrusage(resource.RUSAGE_SELF) if resource is not None else None
+            reply = {"result": usage.ru_utime + usage.ru_stime if usage is not None else 0}
+        elif request["call"] == "new":
+            try:
+                negotiator = negotiator_class()
+                reply = {"result": None}
+            except Exception as error:
+                reply = {"error": "{}: {}".format(error.__class__.__name__, error)}
+        elif negotiator is None:
+            reply = {"error": "no session"}
+        elif request["call"] == "set_rng":
+            (version, state, gauss_next) = request["args"][0]
+            negotiator.rng = Random()
+            negotiator.rng.setstate((version, tuple(state), gauss_next))
+            reply = {"result": None}
+        else:
+            reply = handle_request(negotiator, request)
+        send(reply)
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Worker process serving one submission (started by WorkerPool)")
+    parser.add_argument("spec", help="negotiator class as module.Class")
+    parser.add_argument("--cpu-per-call", type=int, default=10)
+    parser.add_argument("--memory-mb", type=int, default=1024)
+    parser.add_argument("--cpu-lifetime", type=int, default=3600)
+    args = parser.parse_args()
+    run_worker(args.spec, WorkerLimits(args.cpu_per_call, args.memory_mb, cpu_lifetime=args.cpu_lifetime))
@@ -0,0 +1,185 @@
+from array import array
+from csv import DictReader
+from hashlib import sha256
+from mmap import mmap, ACCESS_READ
+from os import makedirs, path, replace, getpid
+from struct import Struct
+from sys import byteorder
+
+# Interns item names into dense integer ids. Ids are handed out in order of first appearance and are
+# never reused, so an id stays valid for as long as the table lives - even when the same table is used
+# across several scenarios. Offers are encoded as compact arrays of ids; names only appear when an offer
+# is decoded for the public API or for printing.
+class ItemTable:
+    def __init__(self, names=()):
+        # Id -> name
+        self.names = []
+        # Name -> id
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    # intern(self : ItemTable, name : String) --> Int
+        # Returns the id of name, assigning it the next free id if it has not been seen before
+    def intern(self, name):
+        item_id = self.ids.get(name)
+        if item_id is None:
+            item_id = len(self.names)
+            self.ids[name] = item_id
+            self.names.append(name)
+        return item_id
+
+    # encode(self : ItemTable, offer : list(String)) --> array(Int)
+        # Converts an offer into an array of item ids. Uses 16-bit ids unless the table has outgrown them
+    def encode(self, offer):
+        ids = self.ids
+        encoded = [ids[name] if name in ids else self.intern(name) for name in offer]
+        return array('H' if len(self.names) <= 0x10000 else 'I', encoded)
+
+    # decode(self : ItemTable, ids : array(Int)) --> list(String)
+        # Converts an array of item ids back into an offer
+    def decode(self, ids):
+        names = self.names
+        return [names[i] for i in ids]
+
+# A single negotiation scenario with its items interned. a_order and b_order hold the item ids of each
+# negotiator's preference ordering, best first, as tuples of ints.
+class Scenario:
+    def __init__(self, iter_limit, items, a_order, b_order, name=None):
+        self.iter_limit = iter_limit
+        self.items = items
+        self.a_order = a_order
+        self.b_order = b_order
+        # Where the scenario came from (its file name, or a description for generated ones)
+        self.name = name
+
+    def __len__(self):
+        return len(self.items)
+
+    # a_preferences(self : Scenario) --> list(String)
+        # Negotiator A's preference ordering, as passed to BaseNegotiator.initialize
+    def a_preferences(self):
+        return self.items.decode(self.a_order)
+
+    # b_preferences(self : Scenario) --> list(String)
+        # Negotiator B's preference ordering, as passed to BaseNegotiator.initialize
+    def b_preferences(self):
+        return self.items.decode(self.b_order)
+
+# read_scenario(parameterfile_name : String) --> (int, list(dict))
+    # Utility function to read in a single scenario from a csv file
+    # Expects a single int on the first line, specifying the iteration limit,
+    # and then an arbitrary number of rows of three comma-separated columns,
+    # specifying the name of each item, its rank (where 1 is best) for negotiator A,
+    # and the same for negotiator B
+def read_scenario(parameterfile_name):
+    # Open the file for reading
+    with open(parameterfile_name, 'r') as parameterfile:
+        # Consume the first line, getting the iteration limit
+        number_iterations = parameterfile.readline()
+        return (
+                int(number_iterations),
+                # Use Python's builtin CSV reader to read the rest of the file as specified
+                list(DictReader(parameterfile, fieldnames=["item_name", "negotiator_a", "negotiator_b"]))
+                )
+
+# build_scenario(num_iters : Int, mapping : list(dict)) --> Scenario
+    # Interns the items of a scenario read by read_scenario and sorts them into each negotiator's
+    # preference ordering
+def build_scenario(num_iters, mapping):
+    items = ItemTable(item["item_name"] for item in mapping)
+    # Separate the mapping out for each negotiator, and sort the items from it
+    # based upon the preferences of each negotiator
+    a_mapping = {items.ids[item["item_name"]] : int(item["negotiator_a"]) for item in mapping}
+    b_mapping = {items.ids[item["item_name"]] : int(item["negotiator_b"]) for item in mapping}
+    return Scenario(
+            num_iters,
+            items,
+            tuple(sorted(a_mapping, key=a_mapping.get, reverse=True)),
+            tuple(sorted(b_mapping, key=b_mapping.get, reverse=True))
+            )
+
+# Compiled scenarios are stored as a fixed header - magic, format version, iteration limit and item count - followed by
+# the item ids of A's and B's preference orders and the end offset of each item's name in the name blob (all unsigned
+# 32-bit little-endian ints), and finally the UTF-8 names themselves. Loading one needs no parsing or sorting.
+COMPILED_MAGIC = b'NEGS'
+COMPILED_VERSION = 1
+COMPILED_HEADER = Struct('<4sIII')
+
+# compile_scenario(scenario : Scenario) --> bytes
+    # Serializes a scenario into the compiled format
+def compile_scenario(scenario):
+    names = [name.encode('utf-8') for name in scenario.items.names]
+    ends = array('I')
+    end = 0
+    for name in names:
+        end += len(name)
+        ends.append(end)
+    ints = array('I', scenario.a_order + scenario.b_order)
+    ints.extend(ends)
+    if byteorder == 'big':
+        ints.byteswap()
+    return COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, scenario.iter_limit, len(names)) + ints.tobytes() + b''.join(names)
+
+# load_compiled_scenario(compiled_name : String) --> Scenario
+    # Memory-maps a compiled scenario file and rebuilds the Scenario from it. Raises ValueError if the file is not a
+    # complete compiled scenario of the current version.
+def load_compiled_scenario(compiled_name):
+    with open(compiled_name, 'rb') as compiled_file, mmap(compiled_file.fileno(), 0, access=ACCESS_READ) as compiled:
+        if len(compiled) < COMPILED_HEADER.size:
+            raise ValueError("{} is truncated".format(compiled_name))
+        (magic, version, iter_limit, count) = COMPILED_HEADER.unpack_from(compiled)
+        if magic != COMPILED_MAGIC or version != COMPILED_VERSION:
+            raise ValueError("{} is not a compiled scenario".format(compiled_name))
+        start = COMPILED_HEADER.size
+        if len(compiled) < start + 12 * count:
+            raise ValueError("{} is truncated".format(compiled_name))
+        ints = array('I')
+        ints.frombytes(compiled[start:start + 12 * count])
+        if byteorder == 'big':
+            ints.byteswap()
+        blob = compiled[start + 12 * count:]
+    if count and ints[-1] != len(blob):
+        raise ValueError("{} is truncated".format(compiled_name))
+    names = []
+    begin = 0
+    for end in ints[2 * count:]:
+        names.append(blob[begin:end].decode('utf-8'))
+        begin = end
+    return Scenario(iter_limit, ItemTable(names), tuple(ints[:count]), tuple(ints[count:2 * count]))
+
+# load_scenario(parameterfile_name : String, cache_dir : String) --> Scenario
+    # Reads a scenario from a csv file (see read_scenario) and interns its items. If cache_dir is given, the scenario
+    # is compiled on first use into cache_dir, keyed by the SHA-256 of the file's contents and the compiled format's
+    # version, and later loads map the compiled file instead of parsing the csv again.
+def load_scenario(parameterfile_name, cache_dir=None):
+    if cache_dir is None:
+        scenario = build_scenario(*read_scenario(parameterfile_name))
+    else:
+        scenario = load_cached_scenario(parameterfile_name, cache_dir)
+    scenario.name = parameterfile_name
+    return scenario
+
+# load_cached_scenario(parameterfile_name : String, cache_dir : String) --> Scenario
+    # The cache_dir half of load_scenario. A compiled file that can't be loaded (truncated, corrupt or from another
+    # version) is compiled again and replaced.
+def load_cached_scenario(parameterfile_name, cache_dir):
+    with open(parameterfile_name, 'rb') as parameterfile:
+        digest = sha256(parameterfile.read()).hexdigest()
+    compiled_name = path.join(cache_dir, "{}.v{}.scenario".format(digest, COMPILED_VERSION))
+    if path.exists(compiled_name):
+        try:
+            return load_compiled_scenario(compiled_name)
+        except ValueError:
+            pass
+    scenario = build_scenario(*read_scenario(parameterfile_name))
+    makedirs(cache_dir, exist_ok=True)
+    # Write to a private temporary name first, so concurrent workers never see a partial file
+    temp_name = "{}.{}.tmp".format(compiled_name, getpid())
+    with open(temp_name, 'wb') as compiled_file:
+        compiled_file.write(compile_scenario(scenario))
+    replace(temp_name, compiled_name)
+    return scenario
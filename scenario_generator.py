@@ -0,0 +1,45 @@
+from random import Random
+from scenario import ItemTable, Scenario
+
+# Synthetic scenarios, generated in memory so the negotiators can be exercised at sizes far beyond the hand-written
+# csv files. Each scenario is a regular Scenario (see scenario.py), so it can go straight into
+# BaseNegotiator.initialize and negotiate() without touching disk.
+
+# How B's preferences relate to A's: the same order, an independent shuffle, the exact reverse, or A's order with
+# noise added (see generate_scenario's noise)
+CORRELATIONS = ("identical", "random", "opposite", "partial")
+
+# generate_scenario(num_items : Int, iter_limit : Int, correlation : String, noise : Float, rng : Random, name : String) --> Scenario
+    # Builds one scenario with num_items items. A's order is a random permutation; B's is derived from it according to
+    # correlation. For "partial", each item's rank for A is perturbed by Gaussian noise with a standard deviation of
+    # noise * num_items before sorting, so 0 gives identical preferences and large values approach "random".
+def generate_scenario(num_items, iter_limit, correlation="random", noise=0.25, rng=None, name=None):
+    if correlation not in CORRELATIONS:
+        raise ValueError("correlation must be one of {}".format(", ".join(CORRELATIONS)))
+    rng = rng if rng is not None else Random()
+    items = ItemTable("item{}".format(i) for i in range(num_items))
+    a_order = list(range(num_items))
+    rng.shuffle(a_order)
+    if correlation == "identical":
+        b_order = a_order[:]
+    elif correlation == "random":
+        b_order = a_order[:]
+        rng.shuffle(b_order)
+    elif correlation == "opposite":
+        b_order = a_order[::-1]
+    else:
+        keys = {item: rank + rng.gauss(0, noise * num_items) for rank, item in enumerate(a_order)}
+        b_order = sorted(a_order, key=keys.get)
+    if name is None:
+        name = "synthetic {} items, {} iterations, {}".format(num_items, iter_limit, correlation)
+    return Scenario(iter_limit, items, tuple(a_order), tuple(b_order), name)
+
+# generate_scenarios(count : Int, num_items : Int, iter_limit : Int, correlation : String, noise : Float, seed : Int) --> generator(Scenario)
+    # Lazily yields count scenarios (forever if count is None) with the given shape. Only the scenario currently being
+    # used is held in memory. With a seed the stream is reproducible.
+def generate_scenarios(count=None, num_items=1000, iter_limit=100, correlation="random", noise=0.25, seed=None):
+    rng = Random(seed)
+    index = 0
+    while count is None or index < count:
+        yield generate_scenario(num_items, iter_limit, correlation, noise, rng, "synthetic #{}: {} items, {} iterations, {}".format(index, num_items, iter_limit, correlation))
+        index += 1
@@ -1,6 +1,12 @@
 from negotiator_base import BaseNegotiator
-from random import random, shuffle, randint
-from functools import reduce
+from assignment import tradeoff_assignment, assignment_total
+from opponent_model import OpponentModel
+from offer_search import IncrementalOffer, narrow_gap
+
+# AsymptoticNegotiator's fair offer (see calc_fair_offer) is solved for exactly up to this many items, at one O(n^3)
+# assignment solve a turn; above it, it is searched for by this many random swaps per item
+FAIR_SOLVE_ITEMS = 100
+FAIR_SEARCH_STEPS_PER_ITEM = 16
 
 # Example negotiator implementation, which randomly chooses to accept
 # an offer or return with a randomized counteroffer.
@@ -55,7 +61,7 @@ class LinearNegotiator(BaseNegotiator):
         res['was_A'] = self.is_A
         res['did_win'] = res['my_points'] > res['their_points']
         res['iters'] = results[3]
-        self.past_iters = 0
+        self.end_round()
         self.past_results.append(res)
 
     def calc_new_offer(self):
@@ -64,7 +70,7 @@ class LinearNegotiator(BaseNegotiator):
         relax_coefficient = int(self.relax_factor * self.past_iters) + 1
         # relax_coefficient = 1 if relax_coefficient == 0 else relax_coefficient
         right_half = ordering[-relax_coefficient:]
-        shuffle(right_half)
+        self.rng.shuffle(right_half)
         ordering[-relax_coefficient:] = right_half
         util = self.get_utility(ordering)
         return ordering
@@ -82,6 +88,30 @@ class LinearNegotiator(BaseNegotiator):
 ## 1b ##
 
 class AsymptoticNegotiator(BaseNegotiator):
+    def __init__(self):
+        super().__init__()
+        # Last fair offer we solved for, as (our preferences, their estimated ranks, offer)
+        self.fair_offer_cache = None
+        # Estimate of their preferences from their offers and reported utilities (see opponent_model.py), and the
+        # utility they reported for the offer they are about to make us
+        self.opponent = OpponentModel([])
+        self.their_last_utility = None
+
+    def initialize(self, preferences, iter_limit):
+        super().initialize(preferences, iter_limit)
+        # Item ids change with our preferences, so the estimate starts over
+        self.opponent = OpponentModel(self.position_weights, self.their_past_offers.window)
+        self.fair_offer_cache = None
+
+    def receive_utility(self, utility):
+        super().receive_utility(utility)
+        self.their_last_utility = utility
+
+    def end_round(self):
+        super().end_round()
+        if self.history_per_round:
+            self.opponent.clear()
+
     # Override the make_offer method from BaseNegotiator to accept a given offer 5%
     # of the time, and return a random permutation the rest of the time.
     def make_offer(self, offer):
@@ -108,6 +138,7 @@ class AsymptoticNegotiator(BaseNegotiator):
                 return offer
 
         self.their_past_offers.append(offer)
+        self.observe_their_offer(offer)
         self.my_past_t_utility.append(self.get_utility(offer))
         self.past_iters += 1
 
@@ -115,18 +146,7 @@ class AsymptoticNegotiator(BaseNegotiator):
             return offer
         elif self.theyre_aggressive():
             # We have a majority of terrible offers from them. Throw them a bone
-            ordering = self.preferences[:]
-            shuffles = 0
-            while True:
-                shuffle(ordering)
-                shuffles += 1
-                t_expected_util = self.their_expected_utility(ordering)
-                m_expected_util = self.get_utility(ordering)
-                diff = abs(m_expected_util - t_expected_util)
-                if (diff <= .3 * abs(m_expected_util) or diff <= .3 * abs(t_expected_util)) and m_expected_util >= t_expected_util and m_expected_util > -len(self.preferences):
-                    break
-                elif shuffles > 1000 and m_expected_util >= t_expected_util and m_expected_util > len(self.preferences):
-                    break
+            ordering = self.calc_fair_offer()
             self.my_past_offers.append(ordering)
             self.my_past_utilities.append(self.get_utility(ordering))
             self.offer = ordering[:]
@@ -146,7 +166,7 @@ class AsymptoticNegotiator(BaseNegotiator):
         res['was_A'] = self.is_A
         res['did_win'] = res['my_points'] > res['their_points']
         res['iters'] = results[3]
-        self.past_iters = 0
+        self.end_round()
         self.past_results.append(res)
 
     def calc_new_offer(self):
@@ -155,7 +175,7 @@ class AsymptoticNegotiator(BaseNegotiator):
         relax_coefficient = int(self.relax_factor * self.past_iters) + 1
         # relax_coefficient = 1 if relax_coefficient == 0 else relax_coefficient
         right_half = ordering[-relax_coefficient:]
-        shuffle(right_half)
+        self.rng.shuffle(right_half)
         ordering[-relax_coefficient:] = right_half
         util = self.get_utility(ordering)
         return ordering
@@ -167,10 +187,7 @@ class AsymptoticNegotiator(BaseNegotiator):
         # bot accepts an offer on the last turn.
         if len(self.past_results) == 0:
             return False
-        for item in self.past_results:
-            if item['was_A'] == False and item['result'] == False and item['iters'] == self.iter_limit-1:
-                return False
-        return True
+        return self.past_results.failed_as_b(self.iter_limit-1) == 0
 
     def should_accept_or_not(self, offer):
         util = self.get_utility(offer)
@@ -196,30 +213,112 @@ class AsymptoticNegotiator(BaseNegotiator):
         if len(self.my_past_t_utility) < .5 * self.iter_limit:
             # Wait till we have some sort of trend data
             return False
-        negs = 0
-        for util in self.my_past_t_utility:
-            negs += 1 if util < 0 else 0
-        return negs > .7*len(self.my_past_t_utility)
-
+        negs = self.my_past_t_utility.negatives
+        return negs > .7*self.my_past_t_utility.retained()
+
+    # observe_their_offer(self, offer : list(String))
+        # Folds their offer, with the utility they reported for it just before making it, into our estimate of
+        # their preferences
+    def observe_their_offer(self, offer):
+        if self.their_last_utility is None:
+            return
+        try:
+            self.opponent.observe(self.encode_offer(offer), self.their_last_utility)
+        except KeyError:
+            pass
+
+    # their_expected_utility(self, offer : list(String)) --> Float
+        # Their utility for offer under our estimate of their preferences, or 0 if we have no estimate yet
     def their_expected_utility(self, offer):
-        if len(self.their_past_utilities) == 0:
+        try:
+            return self.opponent.expected_utility(self.encode_offer(offer))
+        except KeyError as e:
             return 0
-        prefs = None
-        m = -1
-        index = -1
-        for i, util in enumerate(self.their_past_utilities):
-            if util > m:
-                m = util
-                index = i
-        prefs = self.their_past_offers[index]
-        if prefs is not None:
-            try:
-                total = len(prefs)
-                return reduce(lambda points, item: points + ((total / (offer.index(item) + 1)) - abs(offer.index(item) - prefs.index(item))), offer, 0)
-            except ValueError as e:
-                return 0
+
+    # their_expected_utilities(self, candidates : 2-D array(Int)) --> list(Float)
+        # Batched version of their_expected_utility: scores every row of item ids (see encode_offer)
+        # against our estimate of their preferences in one pass
+    def their_expected_utilities(self, candidates):
+        ranks = self.their_ranks()
+        if ranks is None:
+            return [0] * len(candidates)
+        return self.score_candidates(candidates, ranks)
+
+    # their_ranks(self) --> list(Int)
+        # Estimated rank of each of our item ids (see encode_offer) in their preferences. None if we
+        # have no estimate yet.
+    def their_ranks(self):
+        return self.opponent.ranks()
+
+    # their_score_table(self) --> list(list(Float))
+        # Item x position score table for the opponent, based on their_ranks. None if we have no
+        # estimate yet.
+    def their_score_table(self):
+        return self.opponent.score_table()
+
+    # calc_fair_offer(self) --> list(String)
+        # Finds an offer that is good for us but still close to fair for them: exactly (see solve_fair_offer) up to
+        # FAIR_SOLVE_ITEMS items, by local search (see search_fair_offer) above. The result is cached until our
+        # estimate of their preferences changes.
+    def calc_fair_offer(self):
+        ranks = self.their_ranks()
+        if ranks is None:
+            return self.preferences[:]
+        if self.fair_offer_cache is not None and self.fair_offer_cache[0] is self.preferences and self.fair_offer_cache[1] == ranks:
+            return self.fair_offer_cache[2][:]
+        if len(self.preferences) > FAIR_SOLVE_ITEMS:
+            offer = self.search_fair_offer(ranks)
         else:
-            return 0
+            offer = self.solve_fair_offer(self.get_score_table(), self.their_score_table())
+        self.fair_offer_cache = (self.preferences, ranks[:], offer[:])
+        return offer
+
+    # solve_fair_offer(self, mine : list(list(Float)), theirs : list(list(Float))) --> list(String)
+        # Weighs our preferences against the offer maximizing my utility + their expected utility, found with one
+        # O(n^3) assignment solve (see pick_fair_offer).
+    def solve_fair_offer(self, mine, theirs):
+        identity = list(range(len(self.preferences)))
+        own = (assignment_total(mine, identity), assignment_total(theirs, identity), identity)
+        positions = self.pick_fair_offer(tradeoff_assignment(mine, theirs, 1), own)
+        return self.offer_from_positions(positions) if positions is not None else self.preferences[:]
+
+    # search_fair_offer(self, ranks : list(Int)) --> list(String)
+        # Like solve_fair_offer for large scenarios, given their estimated ranks. Our preferences already maximize
+        # my utility + their expected utility, so instead of solving for another offer that does, we walk from our
+        # preferences through ones that do towards an even split (see narrow_gap), in
+        # FAIR_SEARCH_STEPS_PER_ITEM O(1) swaps per item.
+    def search_fair_offer(self, ranks):
+        n = len(ranks)
+        identity = list(range(n))
+        mine = IncrementalOffer(identity, identity, self.position_weights)
+        theirs = IncrementalOffer(identity, ranks, self.position_weights)
+        own = (mine.utility, theirs.utility, identity)
+        narrow_gap(mine, theirs, self.rng, FAIR_SEARCH_STEPS_PER_ITEM * n)
+        ids = self.pick_fair_offer((mine.rescore(), theirs.rescore(), mine.offer()), own)
+        return self.decode_offer(ids) if ids is not None else self.preferences[:]
+
+    # pick_fair_offer(self, joint : (Float, Float, list), own : (Float, Float, list)) --> list
+        # Picks between two (my utility, their expected utility, offer) options: joint, an offer maximizing my
+        # utility + their expected utility, and own, our preferences. For any weight below 1, our preferences are
+        # the only offer maximizing my utility + weight * their expected utility: every item is already where it is
+        # worth most to us, and moving it one position costs us 1 and gains them at most weight. At weight 1 both
+        # options maximize it, so these two are every offer a bisection on the weight could find. Takes the one
+        # with the best joint utility among those that pass our fairness check, or failing that the smallest gap
+        # that still favours us. Returns its offer, or None if neither favours us.
+    def pick_fair_offer(self, joint, own):
+        fair = []
+        favourable = []
+        for (m_expected_util, t_expected_util, offer) in (joint, own):
+            diff = abs(m_expected_util - t_expected_util)
+            if (diff <= .3 * abs(m_expected_util) or diff <= .3 * abs(t_expected_util)) and m_expected_util >= t_expected_util and m_expected_util > -len(self.preferences):
+                fair.append((m_expected_util + t_expected_util, offer))
+            elif m_expected_util >= t_expected_util:
+                favourable.append((-diff, offer))
+        if fair:
+            return max(fair, key=lambda option: option[0])[1]
+        elif favourable:
+            return max(favourable, key=lambda option: option[0])[1]
+        return None
 
 ## 1c ##
 
@@ -267,7 +366,7 @@ class LinearThenAsymptoticNegotiator(BaseNegotiator):
         res['was_A'] = self.is_A
         res['did_win'] = res['my_points'] > res['their_points']
         res['iters'] = results[3]
-        self.past_iters = 0
+        self.end_round()
         self.past_results.append(res)
 
     def calc_new_offer(self):
@@ -276,7 +375,7 @@ class LinearThenAsymptoticNegotiator(BaseNegotiator):
         relax_coefficient = int(self.relax_factor * self.past_iters) + 1
         # relax_coefficient = 1 if relax_coefficient == 0 else relax_coefficient
         right_half = ordering[-relax_coefficient:]
-        shuffle(right_half)
+        self.rng.shuffle(right_half)
         ordering[-relax_coefficient:] = right_half
         util = self.get_utility(ordering)
         return ordering
@@ -351,7 +450,7 @@ class FlexibleNegotiator(BaseNegotiator):
         res['was_A'] = self.is_A
         res['did_win'] = res['my_points'] > res['their_points']
         res['iters'] = results[3]
-        self.past_iters = 0
+        self.end_round()
         self.past_results.append(res)
 
     def calc_new_offer(self):
@@ -360,7 +459,7 @@ class FlexibleNegotiator(BaseNegotiator):
         relax_coefficient = int(self.relax_factor * self.past_iters) + 1
         # relax_coefficient = 1 if relax_coefficient == 0 else relax_coefficient
         right_half = ordering[-relax_coefficient:]
-        shuffle(right_half)
+        self.rng.shuffle(right_half)
         ordering[-relax_coefficient:] = right_half
         util = self.get_utility(ordering)
         return ordering
@@ -409,12 +508,18 @@ class MeanNegotiator(BaseNegotiator):
         res['was_A'] = self.is_A
         res['did_win'] = res['my_points'] > res['their_points']
         res['iters'] = results[3]
-        self.past_iters = 0
+        self.end_round()
         self.past_results.append(res)
 
 ## 3 ##
 
 class PseudoRandomNegotiator(BaseNegotiator):
+    def __init__(self):
+        super().__init__()
+        # The preferences our latest offer was scored under. Histories outlive initialize(), so it can be from an
+        # earlier scenario.
+        self.scored_preferences = None
+
     # Override the make_offer method from BaseNegotiator to accept a given offer 5%
     # of the time, and return a random permutation the rest of the time.
     def make_offer(self, offer):
@@ -423,6 +528,7 @@ class PseudoRandomNegotiator(BaseNegotiator):
             my_offer = self.preferences[:]
             self.my_past_offers.append(my_offer)
             self.my_past_utilities.append(self.get_utility(my_offer))
+            self.scored_preferences = self.preferences
             self.offer = my_offer
             return my_offer
 
@@ -445,9 +551,10 @@ class PseudoRandomNegotiator(BaseNegotiator):
             return offer
 
         else:
-            new_offer = self.calc_new_offer()
+            (new_offer, util) = self.calc_new_offer()
             self.my_past_offers.append(new_offer)
-            self.my_past_utilities.append(self.get_utility(new_offer))
+            self.my_past_utilities.append(util)
+            self.scored_preferences = self.preferences
             self.offer = new_offer[:]
             return new_offer
 
@@ -459,25 +566,26 @@ class PseudoRandomNegotiator(BaseNegotiator):
         res['was_A'] = self.is_A
         res['did_win'] = res['my_points'] > res['their_points']
         res['iters'] = results[3]
-        self.past_iters = 0
+        self.end_round()
         self.past_results.append(res)
 
+    # calc_new_offer(self) --> (list(String), Float)
+        # Our next offer and its utility to us
     def calc_new_offer(self):
         # We will gradually relax on the offers that we are giving.
         # ordering = self.preferences[:]
         if len(self.my_past_offers) > 0:
-            ordering = self.my_past_offers[len(self.my_past_offers)-1][:]
-            first_index = randint(0, len(ordering)-1)
-            second_index = randint(0, len(ordering)-1)
-            first_item = ordering[first_index]
-            second_item = ordering[second_index]
-            ordering[first_index] = second_item
-            ordering[second_index] = first_item
-            util = self.get_utility(ordering)
-            return ordering
+            # Our last offer, with its utility if that was scored under our current preferences, so the swap only
+            # has to rescore the two items it moves; otherwise it is rescored from scratch
+            util = self.my_past_utilities[len(self.my_past_utilities)-1] if self.scored_preferences is self.preferences else None
+            ordering = self.incremental_offer(self.my_past_offers[len(self.my_past_offers)-1], util)
+            first_index = self.rng.randint(0, len(ordering)-1)
+            second_index = self.rng.randint(0, len(ordering)-1)
+            util = ordering.swap(first_index, second_index)
+            return (ordering.offer(), util)
         else:
             util = self.get_utility(self.preferences)
-            return self.preferences
+            return (self.preferences, util)
 
     def should_accept_or_not(self, offer):
         if len(self.their_past_utilities) > 1:
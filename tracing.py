@@ -0,0 +1,82 @@
+from collections import deque
+from json import dumps
+
+# How much a run reports. At TRACE_OFF nothing but the final report is printed; TRACE_SUMMARY adds a line
+# per round and scenario; TRACE_TURNS also records every offer exchanged in negotiate().
+TRACE_OFF = 0
+TRACE_SUMMARY = 1
+TRACE_TURNS = 2
+TRACE_LEVELS = {"off": TRACE_OFF, "summary": TRACE_SUMMARY, "turns": TRACE_TURNS}
+
+# Base trace: summary messages are printed to out, per-turn records are dropped. negotiate() only calls
+# turn() when the trace wants turns, so a quiet run never formats or stores an offer.
+class Trace:
+    def __init__(self, level=TRACE_SUMMARY, out=None):
+        self.level = level
+        self.out = out
+        # Label of the match currently being traced, attached to per-turn records
+        self.match = None
+
+    # wants_turns(self : Trace) --> Boolean
+    def wants_turns(self):
+        return self.level >= TRACE_TURNS
+
+    # start_match(self : Trace, match : String)
+        # Labels the per-turn records that follow
+    def start_match(self, match):
+        self.match = match
+
+    # summary(self : Trace, message : String)
+        # Reports a per-round or per-scenario message
+    def summary(self, message):
+        if self.level >= TRACE_SUMMARY:
+            print(message, file=self.out)
+
+    # turn(self : Trace, i : Int, offer_a : list(String), offer_b : list(String))
+        # Records the offers on the table at the start of iteration i
+    def turn(self, i, offer_a, offer_b):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+# Prints every turn the way negotiate() always has
+class PrintTrace(Trace):
+    def turn(self, i, offer_a, offer_b):
+        print(offer_a, offer_b, file=self.out)
+
+# Keeps the most recent capacity turns in memory, unformatted, for inspection after (or during) a run.
+# The offers are stored by reference, so this costs a tuple per turn regardless of the number of items.
+class RingBufferTrace(Trace):
+    def __init__(self, capacity=1000, level=TRACE_TURNS, out=None):
+        super().__init__(level, out)
+        self.turns = deque(maxlen=capacity)
+
+    def turn(self, i, offer_a, offer_b):
+        self.turns.append((self.match, i, offer_a, offer_b))
+
+# Writes turns as compact JSON lines - [match, iteration, offer_a, offer_b] - to stream, buffering
+# buffer_size records and writing them with a single call. The trace owns stream: close() closes it.
+class JsonlTrace(Trace):
+    def __init__(self, stream, buffer_size=1000, level=TRACE_TURNS, out=None):
+        super().__init__(level, out)
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def turn(self, i, offer_a, offer_b):
+        self.buffer.append((self.match, i, offer_a, offer_b))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write("".join(dumps(record, separators=(",", ":")) + "\n" for record in self.buffer))
+            self.buffer = []
+
+    def close(self):
+        super().close()
+        self.stream.close()